@@ -14,7 +14,7 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'category', 'stock')
+    list_display = ('name', 'price', 'category', 'stock', 'like_count')
 
 
 @admin.register(Image)
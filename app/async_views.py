@@ -0,0 +1,213 @@
+"""
+Async read-only views for the catalog, built on Django's async ORM.
+
+They answer the same JSON as the DRF endpoints they mirror, but only do
+non-blocking work while waiting on the database, so under an ASGI worker
+(see root/asgi.py) one process can keep many slow reads in flight.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, PermissionDenied
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from app.cache import versions_prefix
+from app.filters import ProductFilter
+from app.models import Category, Comment, Like, Product
+from app.pagination import CustomPagination
+from app.serializers import CategorySerializer, CommentSerializer, ProductSerializer
+from app.views import CATEGORY_CACHE_NAMESPACES, PRODUCT_CACHE_NAMESPACES, ProductViewSet, annotate_comment_likes
+
+
+def _json(data, status=200):
+    return JsonResponse(data, encoder=JSONEncoder, safe=False, status=status)
+
+
+def _header_user(request):
+    """
+    The user of DRF's header-based authentication classes (JWT, Basic), run
+    in the order DRF would; the session is left to `request.auser()`.
+    """
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        if issubclass(authentication_class, SessionAuthentication):
+            continue
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+async def _authenticate(request):
+    # Replace the lazy user, whose sync lookup can't run in an async view
+    user = await request.auser()
+    if user.is_authenticated:
+        # Like SessionAuthentication, for the views exempted from the middleware's check
+        await sync_to_async(SessionAuthentication().enforce_csrf)(request)
+    elif 'HTTP_AUTHORIZATION' in request.META:
+        user = await sync_to_async(_header_user)(request) or user
+    request.user = user
+    return user
+
+
+def _authentication_failed(exc):
+    # DRF answers 403 here: SessionAuthentication, listed first, sends no WWW-Authenticate
+    return _json(exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}, status=403)
+
+
+async def _serialize(serializer_class, instance, **kwargs):
+    # Off the event loop: ProductSerializer's category goes through the
+    # registry, which checks the namespace version in the shared cache
+    return await sync_to_async(lambda: serializer_class(instance, **kwargs).data)()
+
+
+async def _cached(request, namespaces, build):
+    """
+    Serve anonymous responses from the versioned cache, like the DRF views'
+    versioned_cache_page. Responses for a logged-in user carry is_liked and
+    are never shared.
+    """
+    try:
+        user = await _authenticate(request)
+    except (AuthenticationFailed, PermissionDenied) as e:
+        return _authentication_failed(e)
+    try:
+        if user.is_authenticated:
+            return _json(await build())
+        prefix = await sync_to_async(versions_prefix)(namespaces)
+        # Payloads hold absolute URLs, so the scheme and host are part of the key
+        key = f'async-page:{prefix}:{request.build_absolute_uri()}'
+        data = await cache.aget(key)
+        request.response_cache = 'hit'
+        if data is None:
+            request.response_cache = 'miss'
+            data = await build()
+            await cache.aset(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return _json(data)
+    except Http404 as e:
+        return JsonResponse({'detail': str(e)}, status=404)
+
+
+async def _paginate(request, queryset):
+    """
+    Page-number pagination with the same response shape as CustomPagination.
+    """
+    paginator = CustomPagination()
+    try:
+        page_size = int(request.GET.get(paginator.page_size_query_param, paginator.page_size))
+        page_number = int(request.GET.get(paginator.page_query_param, 1))
+    except ValueError:
+        raise Http404("Invalid page.")
+    if page_size <= 0:
+        page_size = paginator.page_size
+    page_size = min(page_size, paginator.max_page_size)
+    if page_number < 1:
+        raise Http404("Invalid page.")
+    total = await queryset.acount()
+    num_pages = max((total + page_size - 1) // page_size, 1)
+    if page_number > num_pages:
+        raise Http404("Invalid page.")
+    offset = (page_number - 1) * page_size
+    items = [item async for item in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, paginator.page_query_param, page_number + 1) \
+        if page_number < num_pages else None
+    if page_number <= 1:
+        previous_link = None
+    elif page_number == 2:
+        previous_link = remove_query_param(url, paginator.page_query_param)
+    else:
+        previous_link = replace_query_param(url, paginator.page_query_param, page_number - 1)
+    return items, {
+        'page': page_number,
+        'count': num_pages,
+        'next': next_link,
+        'previous': previous_link,
+        'total': total,
+    }
+
+
+async def _product_context(request, products):
+    context = {'request': request}
+    if request.user.is_authenticated:
+        context['liked_product_ids'] = {
+            product_id async for product_id in Like.objects
+            .filter(user=request.user, product_id__in=[product.pk for product in products])
+            .values_list('product_id', flat=True)
+        }
+    return context
+
+
+@require_GET
+async def product_list(request):
+    async def build():
+        products = ProductFilter(request.GET, queryset=ProductViewSet.queryset.all()).qs
+        items, page = await _paginate(request, products)
+        context = await _product_context(request, items)
+        return {**page, 'results': await _serialize(ProductSerializer, items, many=True, context=context)}
+
+    return await _cached(request, PRODUCT_CACHE_NAMESPACES, build)
+
+
+@require_GET
+async def product_detail(request, pk):
+    async def build():
+        try:
+            product = await ProductViewSet.queryset.aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404("No Product matches the given query.")
+        context = await _product_context(request, [product])
+        return await _serialize(ProductSerializer, product, context=context)
+
+    return await _cached(request, PRODUCT_CACHE_NAMESPACES, build)
+
+
+@require_GET
+async def category_list(request):
+    async def build():
+        items, page = await _paginate(request, Category.objects.all())
+        results = await _serialize(CategorySerializer, items, many=True, context={'request': request})
+        return {**page, 'results': results}
+
+    return await _cached(request, CATEGORY_CACHE_NAMESPACES, build)
+
+
+@require_GET
+async def category_detail(request, pk):
+    async def build():
+        try:
+            category = await Category.objects.aget(pk=pk)
+        except Category.DoesNotExist:
+            raise Http404("No Category matches the given query.")
+        return await _serialize(CategorySerializer, category, context={'request': request})
+
+    return await _cached(request, CATEGORY_CACHE_NAMESPACES, build)
+
+
+@csrf_exempt
+@require_POST
+async def comments_by_product(request):
+    # An authenticated POST like CommentViewSet.by_product, which checks CSRF
+    # only for session users
+    try:
+        user = await _authenticate(request)
+    except (AuthenticationFailed, PermissionDenied) as e:
+        return _authentication_failed(e)
+    if not user.is_authenticated:
+        return _authentication_failed(NotAuthenticated())
+    product_id = request.GET.get("product_id")
+    if not product_id:
+        return JsonResponse({"error": "product_id is required"}, status=400)
+    if not product_id.isdigit():
+        return JsonResponse({"error": "product_id must be an integer"}, status=400)
+    comments = annotate_comment_likes(
+        Comment.objects.filter(product_id=product_id).select_related('user', 'product'), user
+    )
+    items = [comment async for comment in comments]
+    return _json(await _serialize(CommentSerializer, items, many=True, context={'request': request}))
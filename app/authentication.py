@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from app.cache import PRINCIPAL_KEY, principal_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that loads the token's user from the principal cache
+    (PRINCIPAL_CACHE_ALIAS) instead of the database when it can.
+
+    Entries hold the user's field values minus the password, which stays out
+    of the cache and is loaded from the database as a deferred field when
+    something reads it. They're dropped whenever the user is saved or deleted
+    (see app/signals.py), so profile updates, password changes and
+    deactivation apply to the next request; `QuerySet.update()` skips the
+    signals and leaves entries to expire.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = PRINCIPAL_KEY.format(user_id)
+        fields = principal_cache().get(key)
+        if fields is None:
+            user = super().get_user(validated_token)
+            principal_cache().set(key, self.principal_fields(user), settings.PRINCIPAL_CACHE_TIMEOUT)
+            return user
+
+        user = self.user_model.from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+    def principal_fields(self, user):
+        # In concrete field order, as Model.from_db() expects
+        return {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields if field.attname != 'password'
+        }
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    # Documents the same bearer scheme as JWTAuthentication
+    target_class = 'app.authentication.CachedJWTAuthentication'
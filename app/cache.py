@@ -0,0 +1,180 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+
+VERSION_KEY = 'cache-version:{}'
+MODIFIED_KEY = 'cache-modified:{}'
+CART_SUMMARY_KEY = 'cart-summary:{}'
+PRINCIPAL_KEY = 'principal:{}'
+# Per-product namespace of its like_count, bumped on every like, which would
+# otherwise drop every cached product page
+PRODUCT_LIKES_NAMESPACE = 'likes-of-product:{}'
+
+
+def shared_cache():
+    return caches[settings.SHARED_CACHE_ALIAS]
+
+
+def _initial_version():
+    # Seeded from the clock so a version key lost to eviction never comes back
+    # with a number that older cached pages were stored under.
+    return time.time_ns()
+
+
+def get_versions(namespaces):
+    shared = shared_cache()
+    keys = [VERSION_KEY.format(ns) for ns in namespaces]
+    versions = shared.get_many(keys)
+    missing = {key: _initial_version() for key in keys if key not in versions}
+    for key, value in missing.items():
+        shared.add(key, value, timeout=None)
+    if missing:
+        versions.update(shared.get_many(list(missing)))
+    return [versions.get(key, missing.get(key)) for key in keys]
+
+
+def bump_namespace(*namespaces):
+    # A fresh token rather than incr(): the shared backend's incr may be a
+    # get then set (losing one of two concurrent bumps) with the default
+    # timeout, and a version key must never expire
+    shared = shared_cache()
+    shared.set_many({VERSION_KEY.format(ns): time.time_ns() for ns in namespaces}, timeout=None)
+    shared.set_many({MODIFIED_KEY.format(ns): time.time() for ns in namespaces}, timeout=None)
+
+
+def versions_prefix(namespaces):
+    versions = get_versions(namespaces)
+    return ':'.join(f'{ns}.{v}' for ns, v in zip(namespaces, versions))
+
+
+def get_or_set_versioned(key, namespaces, default, timeout):
+    """
+    ``cache.get_or_set`` for a value derived from the given namespaces; a bump
+    of any of them makes the stored value unreachable.
+    """
+    return cache.get_or_set(f'{key}:{versions_prefix(namespaces)}', default, timeout)
+
+
+def metered_cache_page(timeout, key_prefix=None):
+    """
+    ``cache_page`` that notes on the request whether the response came from
+    the cache (`response_cache` is 'hit' or 'miss'), for app/metrics.py.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            # The HttpRequest under a DRF Request, which the middleware sees
+            http_request = getattr(request, '_request', request)
+            http_request.response_cache = 'hit'
+
+            def render(*args, **kwargs):
+                http_request.response_cache = 'miss'
+                response = view_func(*args, **kwargs)
+                # Keys the page on the bearer token too: Vary: Cookie only
+                # separates session users
+                patch_vary_headers(response, ['Authorization'])
+                return response
+
+            return cache_page(timeout, key_prefix=key_prefix)(render)(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def with_object_namespace(namespaces, object_namespace, kwargs):
+    # `object_namespace` is formatted with the pk of a detail view's kwargs
+    if object_namespace is None or 'pk' not in kwargs:
+        return namespaces
+    return (*namespaces, object_namespace.format(kwargs['pk']))
+
+
+def versioned_cache_page(timeout, namespaces, object_namespace=None):
+    """
+    Like ``cache_page`` but keyed on the current version of every namespace the
+    response depends on, so a bump makes all earlier entries unreachable.
+    A detail view can add the namespace of its object with `object_namespace`.
+    Authenticated requests bypass it: their responses carry per-user fields
+    (is_liked) and would otherwise stay cached for hours per token. So do
+    requests flagged `skip_page_cache` (see ReplicaReadsMixin).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.user.is_authenticated or getattr(request, 'skip_page_cache', False):
+                return view_func(request, *args, **kwargs)
+            key_prefix = versions_prefix(with_object_namespace(namespaces, object_namespace, kwargs))
+            return metered_cache_page(timeout, key_prefix=key_prefix)(view_func)(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def last_modified(namespaces):
+    """
+    When any of the namespaces was last bumped. A missing stamp is taken to
+    be now, which can only cost a client a full response.
+    """
+    shared = shared_cache()
+    keys = [MODIFIED_KEY.format(ns) for ns in namespaces]
+    stamps = shared.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in stamps:
+            shared.add(key, now, timeout=None)
+            stamps[key] = shared.get(key, now)
+    return datetime.fromtimestamp(max(stamps.values()), tz=timezone.utc)
+
+
+def versioned_etag(namespaces, object_namespace=None):
+    """
+    A strong ETag for the response to `request`, built from the namespace
+    versions, so it's computed without touching the database.
+    """
+    def etag(request, *args, **kwargs):
+        user = request.user
+        parts = [
+            versions_prefix(with_object_namespace(namespaces, object_namespace, kwargs)),
+            str(user.pk) if user.is_authenticated else '',
+            getattr(request, 'accepted_media_type', ''),
+            request.get_full_path(),
+        ]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    return etag
+
+
+def versioned_condition(namespaces, last_modified_func=None, object_namespace=None):
+    """
+    ``condition`` with a versioned ETag: matching If-None-Match (or, without
+    one, If-Modified-Since) is answered with 304 before the view runs.
+    `last_modified_func` defaults to the last bump of the namespaces.
+    """
+    if last_modified_func is None:
+        def last_modified_func(request, *args, **kwargs):
+            return last_modified(with_object_namespace(namespaces, object_namespace, kwargs))
+
+    return condition(
+        etag_func=versioned_etag(namespaces, object_namespace),
+        last_modified_func=last_modified_func,
+    )
+
+
+def invalidate_cart_summary(user_id):
+    shared_cache().delete(CART_SUMMARY_KEY.format(user_id))
+
+
+def principal_cache():
+    return caches[settings.PRINCIPAL_CACHE_ALIAS]
+
+
+def invalidate_principal(user_id):
+    principal_cache().delete(PRINCIPAL_KEY.format(user_id))
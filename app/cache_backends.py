@@ -0,0 +1,213 @@
+import contextvars
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+_MISSING = object()
+
+# What TieredCache stores in the shared tier: the value with its absolute
+# expiry, so a copy taken into memory never outlives it
+_Entry = namedtuple('_Entry', ['expires_at', 'value'])
+
+# One memory tier per process and cache alias, shared by every thread's
+# backend instance, the same way LocMemCache keeps its module-level stores.
+_stores = {}
+_stores_lock = threading.Lock()
+
+# Lookups of the current request, set by app.middleware.RequestMetricsMiddleware
+request_cache_counts = contextvars.ContextVar('request_cache_counts', default=None)
+
+
+def _count_lookup(counter):
+    counts = request_cache_counts.get()
+    if counts is not None:
+        counts[counter] += 1
+
+
+class LocalStore:
+    """
+    Size- and count-bounded LRU of pickled values with per-entry expiry.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'shared_hits': 0,
+            'shared_misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return _MISSING
+            expires_at, data = entry
+            if expires_at <= time.time():
+                self._pop(key)
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return _MISSING
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+        return pickle.loads(data)
+
+    def set(self, key, value, expires_at):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            self.delete(key)
+            return
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (expires_at, data)
+            self.size += len(data)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._pop(oldest)
+                self.counters['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def record(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.size)
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class TieredCache(BaseCache):
+    """
+    Per-process memory LRU in front of a shared cache alias.
+
+    Writes go to both tiers, reads are served from memory when possible. Entries
+    stay in memory for at most LOCAL_TIMEOUT seconds, and never past their
+    expiry in the shared tier, which bounds how long a write made by another
+    process can go unseen here.
+
+    OPTIONS:
+        SHARED_ALIAS       alias of the shared backend in CACHES
+        LOCAL_TIMEOUT      seconds an entry may live in the memory tier
+        LOCAL_MAX_ENTRIES  entry count limit of the memory tier
+        LOCAL_MAX_BYTES    pickled size limit of the memory tier
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 300)
+        with _stores_lock:
+            self._local = _stores.setdefault(location or self._shared_alias, LocalStore(
+                max_entries=options.get('LOCAL_MAX_ENTRIES', 1000),
+                max_bytes=options.get('LOCAL_MAX_BYTES', 32 * 1024 * 1024),
+            ))
+
+    @property
+    def _shared(self):
+        return caches[self._shared_alias]
+
+    def _local_expiry(self, expires_at):
+        # Never past the shared entry's own expiry
+        local_expires_at = time.time() + self._local_timeout
+        return local_expires_at if expires_at is None else min(local_expires_at, expires_at)
+
+    def _entry(self, value, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return _Entry(self.get_backend_timeout(timeout), value), timeout
+
+    def _shared_get(self, key, version):
+        entry = self._shared.get(key, _MISSING, version=version)
+        if entry is _MISSING or isinstance(entry, _Entry):
+            return entry
+        # Stored before entries carried their expiry
+        return _Entry(None, entry)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self._local.get(local_key)
+        if value is not _MISSING:
+            _count_lookup('hits')
+            return value
+        entry = self._shared_get(key, version)
+        if entry is _MISSING:
+            self._local.record('shared_misses')
+            _count_lookup('misses')
+            return default
+        self._local.record('shared_hits')
+        _count_lookup('hits')
+        self._local.set(local_key, entry.value, self._local_expiry(entry.expires_at))
+        return entry.value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry, timeout = self._entry(value, timeout)
+        self._shared.set(key, entry, timeout=timeout, version=version)
+        self._local.set(local_key, value, self._local_expiry(entry.expires_at))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry, timeout = self._entry(value, timeout)
+        if not self._shared.add(key, entry, timeout=timeout, version=version):
+            return False
+        self._local.set(local_key, value, self._local_expiry(entry.expires_at))
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        # Rewritten rather than touched, so the stored expiry follows
+        entry = self._shared_get(key, version)
+        if entry is _MISSING:
+            self._local.delete(self.make_and_validate_key(key, version=version))
+            return False
+        self.set(key, entry.value, timeout, version=version)
+        return True
+
+    def delete(self, key, version=None):
+        self._local.delete(self.make_and_validate_key(key, version=version))
+        return self._shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        # A get then set, like BaseCache.incr(), keeping the remaining lifetime
+        entry = self._shared_get(key, version)
+        if entry is _MISSING:
+            raise ValueError(f"Key '{key}' not found")
+        timeout = None if entry.expires_at is None else max(entry.expires_at - time.time(), 0)
+        value = entry.value + delta
+        self.set(key, value, timeout, version=version)
+        return value
+
+    def clear(self):
+        self._local.clear()
+        self._shared.clear()
+
+    def stats(self):
+        return self._local.stats()
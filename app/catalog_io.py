@@ -0,0 +1,352 @@
+"""
+Bulk catalog import and export, used by the `import_catalog` and
+`export_catalog` management commands.
+
+Rows are streamed in batches, so memory stays flat whatever the file size.
+Each batch is upserted in its own transaction: on PostgreSQL through COPY
+into a temporary table followed by one UPDATE and one INSERT, elsewhere
+with bulk_update and bulk_create. Bulk writes skip the model signals, so
+the datasets refresh the derived data (search documents, primary images,
+category stats, cache versions) themselves.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import slugify
+
+from app.cache import bump_namespace
+from app.models import Category, Image, Product
+from app.search import build_search_document
+from app.signals import refresh_primary_images
+from app.stats import refresh_category_stats
+
+FORMATS = ('jsonl', 'csv')
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(file, format):
+    if format == 'csv':
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield RowError(f"Invalid JSON: {e}")
+
+
+def write_rows(file, format, fields, rows):
+    if format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    for row in rows:
+        file.write(json.dumps({field: row[field] for field in fields}, ensure_ascii=False, default=str))
+        file.write('\n')
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _clean_field(model, name, value):
+    field = model._meta.get_field(name)
+    try:
+        value = field.to_python(value)
+        field.run_validators(value)
+    except ValidationError as e:
+        raise RowError(f"{name}: {' '.join(e.messages)}")
+    return value
+
+
+def _required(row, name):
+    value = row.get(name)
+    if value in (None, ''):
+        raise RowError(f"{name} is required.")
+    return value
+
+
+def _product_ids(keys):
+    """
+    Map (brand, model) pairs to product ids, the oldest product wins when the
+    catalog has duplicates.
+    """
+    brands = {brand for brand, _ in keys}
+    models = {model for _, model in keys}
+    ids = {}
+    products = Product.objects.filter(brand__in=brands, model__in=models) \
+        .order_by('-pk').values_list('brand', 'model', 'pk')
+    for brand, model, pk in products:
+        if (brand, model) in keys:
+            ids[brand, model] = pk
+    return ids
+
+
+def _copy_upsert(model, keys, insert_fields, update_fields, rows):
+    """
+    Upsert `rows` (dicts of column values) through a temporary table filled
+    with COPY. Returns (created, updated). Like `_product_ids`, only the
+    oldest row of duplicated keys is updated.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = [model._meta.get_field(name).column for name in insert_fields]
+    key_columns = [model._meta.get_field(name).column for name in keys]
+    update_columns = [model._meta.get_field(name).column for name in update_fields]
+    staging = qn(f'{model._meta.db_table}_import')
+    column_list = ', '.join(qn(column) for column in columns)
+    matches = ' AND '.join(f'target.{qn(column)} = staging.{qn(column)}' for column in key_columns)
+    pk = qn(model._meta.pk.column)
+    oldest = (
+        f'SELECT MIN(oldest.{pk}) FROM {table} AS oldest WHERE '
+        + ' AND '.join(f'oldest.{qn(column)} = staging.{qn(column)}' for column in key_columns)
+    )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[name] for name in insert_fields])
+    buffer.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA'
+        )
+        copy_sql = f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'):  # psycopg2
+            raw.copy_expert(copy_sql, buffer)
+        else:  # psycopg 3
+            with raw.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+        cursor.execute(
+            f'UPDATE {table} AS target SET '
+            + ', '.join(f'{qn(column)} = staging.{qn(column)}' for column in update_columns)
+            + f' FROM {staging} AS staging WHERE target.{pk} = ({oldest})'
+        )
+        updated = cursor.rowcount
+        cursor.execute(
+            f'INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} AS staging '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {table} AS target WHERE {matches})'
+        )
+        created = cursor.rowcount
+    return created, updated
+
+
+class Dataset:
+    """
+    One kind of catalog row. Subclasses list their export `fields`, turn an
+    import row into column values in `clean` and write a batch in `upsert`.
+    """
+    model = None
+    fields = ()
+    keys = ()
+    namespaces = ()
+
+    def export_rows(self):
+        raise NotImplementedError
+
+    def export_count(self):
+        return self.model.objects.count()
+
+    def clean(self, row):
+        raise NotImplementedError
+
+    def upsert(self, rows):
+        raise NotImplementedError
+
+    def import_batch(self, batch):
+        """
+        Upsert one batch of parsed rows. Returns (created, updated, errors),
+        where errors pairs the index of each rejected row with its message.
+        """
+        cleaned = {}
+        errors = []
+        for index, row in enumerate(batch):
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RowError("Expected an object.")
+                values = self.clean(row)
+            except RowError as e:
+                errors.append((index, str(e)))
+                continue
+            # A key repeated within the batch keeps its last row
+            cleaned[tuple(values[key] for key in self.keys)] = values
+        if not cleaned:
+            return 0, 0, errors
+        with transaction.atomic():
+            created, updated = self.upsert(cleaned)
+        return created, updated, errors
+
+    def finish(self):
+        bump_namespace(*self.namespaces)
+
+
+class CategoryDataset(Dataset):
+    model = Category
+    fields = ('slug', 'name', 'image')
+    keys = ('slug',)
+    namespaces = ('category',)
+
+    def export_rows(self):
+        return Category.objects.order_by('pk').values(*self.fields).iterator()
+
+    def clean(self, row):
+        name = _clean_field(Category, 'name', _required(row, 'name'))
+        return {
+            'slug': _clean_field(Category, 'slug', row.get('slug') or slugify(name)),
+            'name': name,
+            'image': _clean_field(Category, 'image', row.get('image') or ''),
+        }
+
+    def upsert(self, rows):
+        existing = dict(Category.objects.filter(slug__in=[slug for slug, in rows]).values_list('slug', 'pk'))
+        now = timezone.now()
+        to_create, to_update = [], []
+        for (slug,), values in rows.items():
+            category = Category(pk=existing.get(slug), updated_at=now, **values)
+            (to_update if category.pk else to_create).append(category)
+        Category.objects.bulk_create(to_create)
+        Category.objects.bulk_update(to_update, ['name', 'image', 'updated_at'])
+        return len(to_create), len(to_update)
+
+    def finish(self):
+        # Creates the stats rows of new categories
+        refresh_category_stats()
+        super().finish()
+
+
+class ProductDataset(Dataset):
+    model = Product
+    fields = ('brand', 'model', 'category', 'name', 'description', 'price', 'stock')
+    keys = ('brand', 'model')
+    namespaces = ('product',)
+    update_fields = ('category_id', 'name', 'description', 'price', 'stock', 'search_document', 'updated_at')
+
+    def __init__(self):
+        self.category_ids = dict(Category.objects.values_list('slug', 'pk'))
+
+    def export_rows(self):
+        rows = Product.objects.order_by('pk') \
+            .values(*[field for field in self.fields if field != 'category'], category_slug=F('category__slug')) \
+            .iterator()
+        for row in rows:
+            row['category'] = row.pop('category_slug')
+            yield row
+
+    def clean(self, row):
+        slug = _required(row, 'category')
+        if slug not in self.category_ids:
+            raise RowError(f"Unknown category {slug!r}.")
+        values = {
+            name: _clean_field(Product, name, _required(row, name))
+            for name in ('brand', 'model', 'name', 'price', 'stock')
+        }
+        values['description'] = _clean_field(Product, 'description', row.get('description') or '')
+        values['category_id'] = self.category_ids[slug]
+        values['search_document'] = build_search_document(Product(**values))
+        return values
+
+    def upsert(self, rows):
+        now = timezone.now()
+        if connection.vendor == 'postgresql':
+            for values in rows.values():
+                values.update(updated_at=now, like_count=0)
+            return _copy_upsert(
+                Product, self.keys, [*self.keys, 'like_count', *self.update_fields], self.update_fields,
+                rows.values(),
+            )
+
+        existing = _product_ids(set(rows))
+        to_create, to_update = [], []
+        for key, values in rows.items():
+            product = Product(pk=existing.get(key), updated_at=now, **values)
+            (to_update if product.pk else to_create).append(product)
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update, self.update_fields)
+        return len(to_create), len(to_update)
+
+    def finish(self):
+        # One grouped query; a product may also have moved between categories
+        refresh_category_stats()
+        super().finish()
+
+
+class ImageDataset(Dataset):
+    """
+    Image rows reference files already in media storage by name; the files
+    themselves are synced separately.
+    """
+    model = Image
+    fields = ('brand', 'model', 'image', 'order')
+    keys = ('product_id', 'image')
+    namespaces = ('image', 'product')
+
+    def export_rows(self):
+        return Image.objects.filter(product__isnull=False).order_by('pk') \
+            .values('image', 'order', brand=F('product__brand'), model=F('product__model')) \
+            .iterator()
+
+    def export_count(self):
+        return Image.objects.filter(product__isnull=False).count()
+
+    def import_batch(self, batch):
+        keys = set()
+        for row in batch:
+            if isinstance(row, dict) and row.get('brand') and row.get('model'):
+                keys.add((str(row['brand']), str(row['model'])))
+        self.product_ids = _product_ids(keys)
+        return super().import_batch(batch)
+
+    def clean(self, row):
+        product_id = self.product_ids.get((str(_required(row, 'brand')), str(_required(row, 'model'))))
+        if product_id is None:
+            raise RowError(f"Unknown product {row['brand']} {row['model']}.")
+        return {
+            'product_id': product_id,
+            'image': _clean_field(Image, 'image', _required(row, 'image')),
+            'order': _clean_field(Image, 'order', row.get('order') or 0),
+        }
+
+    def upsert(self, rows):
+        product_ids = {product_id for product_id, _ in rows}
+        if connection.vendor == 'postgresql':
+            created, updated = _copy_upsert(Image, self.keys, [*self.keys, 'order'], ['order'], rows.values())
+        else:
+            existing = {
+                (product_id, image): pk for product_id, image, pk in
+                Image.objects.filter(product_id__in=product_ids, image__in={image for _, image in rows})
+                .order_by('-pk').values_list('product_id', 'image', 'pk')
+            }
+            to_create, to_update = [], []
+            for key, values in rows.items():
+                image = Image(pk=existing.get(key), **values)
+                (to_update if image.pk else to_create).append(image)
+            Image.objects.bulk_create(to_create)
+            Image.objects.bulk_update(to_update, ['order'])
+            created, updated = len(to_create), len(to_update)
+
+        refresh_primary_images(product_ids)
+        return created, updated
+
+
+DATASETS = {
+    'categories': CategoryDataset,
+    'products': ProductDataset,
+    'images': ImageDataset,
+}
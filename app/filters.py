@@ -0,0 +1,57 @@
+import hashlib
+
+from django.db.models import Count
+from django_filters import rest_framework as filters
+
+from app.models import Product
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
+class CharInFilter(filters.BaseInFilter, filters.CharFilter):
+    pass
+
+
+class ProductFilter(filters.FilterSet):
+    category = NumberInFilter(field_name='category_id')
+    brand = CharInFilter(field_name='brand')
+    min_price = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    in_stock = filters.BooleanFilter(method='filter_in_stock')
+
+    class Meta:
+        model = Product
+        fields = ['category', 'brand', 'min_price', 'max_price', 'in_stock']
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(stock__gt=0) if value else queryset.filter(stock=0)
+
+    @classmethod
+    def cache_key(cls, query_params):
+        """
+        Key identifying the filter combination in `query_params`, ignoring
+        parameter order and anything that isn't a filter.
+        """
+        params = sorted((name, query_params.get(name)) for name in cls.base_filters if name in query_params)
+        digest = hashlib.md5(repr(params).encode()).hexdigest()
+        return f'product-facets:{digest}'
+
+
+def product_facets(queryset):
+    queryset = queryset.order_by()
+    return {
+        'total': queryset.count(),
+        'brands': list(
+            queryset.values('brand')
+            .annotate(count=Count('pk'))
+            .order_by('-count', 'brand')
+        ),
+        'categories': [
+            {'id': category_id, 'name': name, 'count': count}
+            for category_id, name, count in queryset.values_list('category_id', 'category__name')
+            .annotate(count=Count('pk'))
+            .order_by('-count', 'category__name')
+        ],
+    }
@@ -0,0 +1,337 @@
+import json
+import random
+import re
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app.models import Category, CustomUser, Product
+
+
+@dataclass
+class Route:
+    weight: int
+    path: object
+    method: str = 'GET'
+    auth: bool = False
+
+
+# Weighted like the catalog traffic: mostly anonymous product reads. Paths are
+# callables taking the Fixtures, the writes (likes) invalidate cached pages.
+# Routes weighted 0 only run when asked for with --mix or --only.
+ROUTES = {
+    'product-list': Route(20, lambda f: '/product/'),
+    # The filters ignore the unknown parameter, but it gives every request
+    # its own page cache key so each one reaches the database
+    'product-list-uncached': Route(0, lambda f: f'/product/?nocache={f.rng.getrandbits(64)}'),
+    'product-list-page': Route(5, lambda f: f'/product/?page={f.rng.randint(2, 5)}'),
+    'product-list-cursor': Route(5, lambda f: '/product/?pagination=cursor'),
+    'product-filter': Route(6, lambda f: f'/product/?category={f.category()}&in_stock=true'),
+    'product-detail': Route(18, lambda f: f'/product/{f.product()}/'),
+    'product-search': Route(6, lambda f: f'/product/search/?q={f.word()}'),
+    'product-facets': Route(3, lambda f: f'/product/facets/?category={f.category()}'),
+    'category-list': Route(5, lambda f: '/category/'),
+    'category-detail': Route(3, lambda f: f'/category/{f.category()}/'),
+    'category-stats': Route(1, lambda f: '/category/stats/'),
+    'comment-list': Route(3, lambda f: '/comment/'),
+    'async-product-list': Route(2, lambda f: '/async/product/'),
+    'async-product-detail': Route(2, lambda f: f'/async/product/{f.product()}/'),
+    'comments-by-product': Route(3, lambda f: f'/comment/by_product/?product_id={f.product()}', 'POST', True),
+    'liked-list': Route(4, lambda f: '/liked/', auth=True),
+    'favorite-list': Route(2, lambda f: '/favorite/', auth=True),
+    'cart-list': Route(4, lambda f: '/cart/', auth=True),
+    'cart-summary': Route(3, lambda f: '/cart/summary/', auth=True),
+    'user-me': Route(2, lambda f: '/auth/me/', auth=True),
+    'product-like': Route(1, lambda f: f'/product/{f.product()}/like/', 'POST', True),
+}
+
+
+class Fixtures:
+    """
+    Ids to build paths from, sampled from the database (see `seed_data`).
+    """
+    words = ['phone', 'camera', 'smart', 'pro', 'wireless', 'battery', 'max', 'silver']
+
+    def __init__(self, rng):
+        self.rng = rng
+        # Sampled with the seeded generator, so a run can be replayed
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        self.product_ids = rng.sample(product_ids, min(len(product_ids), 1000))
+        self.category_ids = list(Category.objects.order_by('pk').values_list('pk', flat=True))
+        if not self.product_ids or not self.category_ids:
+            raise CommandError("No products to request, seed some with `manage.py seed_data`.")
+
+    def product(self):
+        return self.rng.choice(self.product_ids)
+
+    def category(self):
+        return self.rng.choice(self.category_ids)
+
+    def word(self):
+        return self.rng.choice(self.words)
+
+
+class RowCountingCursor:
+    """
+    Wraps a DB-API cursor to count the rows fetched through it.
+    """
+
+    def __init__(self, cursor, sample):
+        self.cursor = cursor
+        self.sample = sample
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.sample['rows'] += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.sample['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.sample['rows'] += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.sample['rows'] += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of the API routes, in process through the test client (counting SQL "
+        "queries and rows read) or against a running server, and report latency per route."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls', nargs='*',
+            help="Absolute URLs to GET with equal weights instead of the route mix (implies a server).",
+        )
+        parser.add_argument(
+            '--server', help="Base URL of a running server, e.g. http://127.0.0.1:8000. Query counts "
+                             "are only reported when it sends Server-Timing (SERVER_TIMING_HEADER).",
+        )
+        parser.add_argument(
+            '--mix', help=f"Comma separated name=weight overrides, names: {', '.join(ROUTES)}.",
+        )
+        parser.add_argument('--only', help="Comma separated route names to request, with equal weights.")
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=32, help="Threads, with --server or urls only.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the request sequence.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--compare', help="Results JSON of an earlier run to print the differences to.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['urls']:
+            routes = {url: Route(1, url) for url in options['urls']}
+            base_url = ''
+        else:
+            routes = self.routes(options['mix'], options['only'])
+            base_url = options['server']
+        fixtures = Fixtures(rng) if not options['urls'] else None
+
+        names = rng.choices(list(routes), weights=[route.weight for route in routes.values()], k=options['requests'])
+        plan = [
+            (name, routes[name].method, routes[name].path(fixtures) if callable(routes[name].path)
+             else routes[name].path, routes[name].auth)
+            for name in names
+        ]
+        token = None
+        if any(auth for *_, auth in plan):
+            users = CustomUser.objects.filter(is_active=True).order_by('pk')
+            user = users.filter(username__startswith='seed-').first() or users.first()
+            if user is None:
+                raise CommandError("Authenticated routes need a user, seed some with `manage.py seed_data`.")
+            token = str(RefreshToken.for_user(user).access_token)
+
+        started = time.perf_counter()
+        if base_url is None:
+            samples = self.run_in_process(plan, token)
+        else:
+            samples = self.run_against_server(base_url, plan, token, options['concurrency'])
+        elapsed = time.perf_counter() - started
+
+        results = {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'target': 'test client' if base_url is None else base_url or 'urls',
+            'requests': len(samples),
+            'concurrency': 1 if base_url is None else options['concurrency'],
+            'seed': options['seed'],
+            'requests_per_second': round(len(samples) / elapsed, 1),
+            'routes': self.summarize(samples),
+        }
+        self.report(results)
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.compare(json.load(file), results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def routes(self, mix, only=None):
+        routes = dict(ROUTES)
+        if only:
+            unknown = set(only.split(',')) - set(routes)
+            if unknown:
+                raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}.")
+            routes = {
+                name: Route(1, routes[name].path, routes[name].method, routes[name].auth) for name in only.split(',')
+            }
+        for item in (mix or '').split(','):
+            if not item:
+                continue
+            name, _, weight = item.partition('=')
+            if name not in routes or not weight.isdigit():
+                raise CommandError(f"Invalid mix entry {item!r}.")
+            routes[name] = Route(int(weight), routes[name].path, routes[name].method, routes[name].auth)
+        return {name: route for name, route in routes.items() if route.weight}
+
+    def run_in_process(self, plan, token):
+        """
+        One request at a time through the test client, so the SQL queries and
+        rows fetched during each can be attributed to it.
+        """
+        client = Client(raise_request_exception=False)
+        sample = {}
+
+        def count(execute, sql, params, many, context):
+            sample['queries'] += 1
+            wrapper = context['cursor']
+            if not isinstance(wrapper.cursor, RowCountingCursor):
+                wrapper.cursor = RowCountingCursor(wrapper.cursor, sample)
+            wrapper.cursor.sample = sample
+            return execute(sql, params, many, context)
+
+        samples = []
+        with connection.execute_wrapper(count):
+            for name, method, path, auth in plan:
+                sample = {'route': name, 'queries': 0, 'rows': 0}
+                headers = {'Authorization': f'Bearer {token}'} if auth else {}
+                started = time.perf_counter()
+                response = client.generic(method, path, headers=headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                sample.update(latency=time.perf_counter() - started, status=response.status_code)
+                samples.append(sample)
+        return samples
+
+    def run_against_server(self, base_url, plan, token, concurrency):
+        def fetch(step):
+            name, method, path, auth = step
+            request = urllib.request.Request(base_url.rstrip('/') + path if base_url else path, method=method)
+            if auth:
+                request.add_header('Authorization', f'Bearer {token}')
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status, headers = response.status, response.headers
+            except urllib.error.HTTPError as e:
+                status, headers = e.code, e.headers
+            sample = {'route': name, 'latency': time.perf_counter() - started, 'status': status}
+            # Query counts come from RequestMetricsMiddleware, rows aren't reported
+            queries = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+            if queries:
+                sample['queries'] = int(queries.group(1))
+            return sample
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(fetch, plan))
+
+    def summarize(self, samples):
+        by_route = defaultdict(list)
+        for sample in samples:
+            by_route[sample['route']].append(sample)
+
+        summary = {}
+        for name, route_samples in sorted(by_route.items()):
+            latencies = [sample['latency'] * 1000 for sample in route_samples]
+            has_queries = all('queries' in sample for sample in route_samples)
+            has_rows = all('rows' in sample for sample in route_samples)
+            summary[name] = {
+                'requests': len(route_samples),
+                'errors': sum(1 for sample in route_samples if sample['status'] >= 400),
+                'mean_ms': round(statistics.mean(latencies), 2),
+                'p50_ms': round(percentile(latencies, .5), 2),
+                'p95_ms': round(percentile(latencies, .95), 2),
+                'p99_ms': round(percentile(latencies, .99), 2),
+                'queries_per_request': round(statistics.mean(
+                    sample['queries'] for sample in route_samples), 2) if has_queries else None,
+                'rows_per_request': round(statistics.mean(
+                    sample['rows'] for sample in route_samples), 1) if has_rows else None,
+            }
+        return summary
+
+    def report(self, results):
+        self.stdout.write(
+            f"{results['requests']} requests to {results['target']}, concurrency {results['concurrency']}: "
+            f"{results['requests_per_second']} req/s"
+        )
+        width = max(len(name) for name in results['routes'])
+        self.stdout.write(
+            f"{'route':<{width}}  {'n':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'rows':>8}"
+        )
+        for name, route in results['routes'].items():
+            queries = '-' if route['queries_per_request'] is None else route['queries_per_request']
+            rows = '-' if route['rows_per_request'] is None else route['rows_per_request']
+            self.stdout.write(
+                f"{name:<{width}}  {route['requests']:>5} {route['errors']:>4} {route['p50_ms']:>8} "
+                f"{route['p95_ms']:>8} {route['p99_ms']:>8} {queries:>8} {rows:>8}"
+            )
+
+    def compare(self, previous, results):
+        self.stdout.write(
+            f"\nAgainst {previous.get('commit') or previous['created_at']}: "
+            f"{results['requests_per_second'] - previous['requests_per_second']:+.1f} req/s"
+        )
+        for name, route in results['routes'].items():
+            before = previous['routes'].get(name)
+            if before is None:
+                continue
+            line = f"{name}: p95 {route['p95_ms'] - before['p95_ms']:+.2f} ms"
+            if route['queries_per_request'] is not None and before['queries_per_request'] is not None:
+                line += f", queries {route['queries_per_request'] - before['queries_per_request']:+.2f}"
+            if route['rows_per_request'] is not None and before['rows_per_request'] is not None:
+                line += f", rows {route['rows_per_request'] - before['rows_per_request']:+.1f}"
+            self.stdout.write(line)
@@ -0,0 +1,103 @@
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+MODES = ('none', 'persistent', 'pool')
+# `pool` needs psycopg 3 and psycopg_pool, which requirements.txt leaves out
+DEFAULT_MODES = ('none', 'persistent')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Start gunicorn once per DB_CONN_MODE (see settings) and compare the requests per second "
+        "of the uncached product list under each. Uses the database of the current settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modes', default=','.join(DEFAULT_MODES),
+            help=f"Comma separated DB_CONN_MODE values among {', '.join(MODES)}; pool needs psycopg[pool].",
+        )
+        parser.add_argument('--route', default='product-list-uncached', help="Benchmark route to request.")
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--startup-timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        modes = options['modes'].split(',')
+        if set(modes) - set(MODES):
+            raise CommandError(f"Modes must be among {', '.join(MODES)}.")
+        if 'pool' in modes and importlib.util.find_spec('psycopg_pool') is None:
+            raise CommandError('The pool mode needs `pip install "psycopg[binary,pool]"`.')
+
+        results = {}
+        for mode in modes:
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', 'root.wsgi:application', '--bind', f'127.0.0.1:{port}',
+                 '--workers', str(options['workers']), '--threads', str(options['threads'])],
+                cwd=settings.BASE_DIR, env={
+                    **os.environ, 'DB_CONN_MODE': mode, 'REQUEST_LOG_LEVEL': 'ERROR', 'SERVER_TIMING_HEADER': 'True',
+                },
+            )
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                self.wait_for(base_url, server, options['startup_timeout'])
+                with tempfile.NamedTemporaryFile(suffix='.json') as output:
+                    call_command(
+                        'benchmark', server=base_url, only=options['route'], requests=options['requests'],
+                        concurrency=options['concurrency'], output=output.name, stdout=self.stdout,
+                    )
+                    results[mode] = json.load(output)
+            finally:
+                server.terminate()
+                server.wait()
+
+        self.stdout.write(
+            f"\n{options['route']}, {options['workers']} workers x {options['threads']} threads, "
+            f"concurrency {options['concurrency']}:"
+        )
+        for mode, result in results.items():
+            route = result['routes'][options['route']]
+            self.stdout.write(
+                f"{mode:<10} {result['requests_per_second']:>8} req/s  p50 {route['p50_ms']} ms  "
+                f"p95 {route['p95_ms']} ms  errors {route['errors']}"
+            )
+
+    def wait_for(self, base_url, server, timeout):
+        deadline = time.monotonic() + timeout
+        problem = "no answer"
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"gunicorn exited with status {server.returncode}.")
+            try:
+                with urllib.request.urlopen(f'{base_url}/category/', timeout=1):
+                    return
+            except urllib.error.HTTPError as e:
+                # Redirects that urllib doesn't follow still mean the app is up
+                if e.code < 400:
+                    return
+                problem = f"last answer {e.code}"
+            except OSError:
+                pass
+            time.sleep(.2)
+        raise CommandError(f"gunicorn wasn't ready within {timeout}s ({problem}).")
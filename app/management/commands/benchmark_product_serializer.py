@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from app.models import Category, Product
+from app.serializers import FastProductListSerializer, ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare ProductSerializer and FastProductListSerializer on product pages of the given sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Runs against throwaway rows that are rolled back at the end
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, sizes, repeat):
+        categories = [
+            Category.objects.create(name=f'Benchmark {i}', slug=f'benchmark-{i}', image='category/images/1.jpg')
+            for i in range(20)
+        ]
+        Product.objects.bulk_create([
+            Product(category=categories[i % len(categories)], name=f'Product {i}', description='x' * 200,
+                    price=i + 0.99, stock=i % 7, brand='Brand', model=f'M{i}')
+            for i in range(max(sizes))
+        ])
+        request = Request(APIRequestFactory().get('/product/'))
+        context = {'request': request, 'liked_product_ids': set()}
+        products = Product.objects.select_related('category', 'primary_image') \
+            .filter(category__in=categories).order_by('-id')
+
+        def drf(size):
+            return ProductSerializer(list(products[:size]), many=True, context=context).data
+
+        def fast(size):
+            rows = list(products.values(*FastProductListSerializer.value_fields)[:size])
+            return FastProductListSerializer(rows, context=context).data
+
+        for size in sizes:
+            assert JSONRenderer().render(drf(size)) == JSONRenderer().render(fast(size))
+            drf_ms = self.time(drf, size, repeat)
+            fast_ms = self.time(fast, size, repeat)
+            self.stdout.write(
+                f"{size:>5} rows: ProductSerializer {drf_ms:8.2f} ms  "
+                f"FastProductListSerializer {fast_ms:8.2f} ms  speedup {drf_ms / fast_ms:.1f}x"
+            )
+
+    def time(self, build, size, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            build(size)
+        return (time.perf_counter() - started) * 1000 / repeat
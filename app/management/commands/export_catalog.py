@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+from app.catalog_io import DATASETS, FORMATS, write_rows
+
+
+class Command(BaseCommand):
+    help = "Stream categories, products or images to a JSONL or CSV file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=DATASETS)
+        parser.add_argument('output', help="File to write, '-' for stdout.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the output file's extension.")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        format = options['format'] or ('csv' if output.endswith('.csv') else 'jsonl')
+        dataset = DATASETS[options['dataset']]()
+
+        started = time.monotonic()
+        rows = tqdm(
+            dataset.export_rows(), total=dataset.export_count(), unit='rows',
+            disable=options['verbosity'] == 0 or output == '-',
+        )
+        if output == '-':
+            write_rows(sys.stdout, format, dataset.fields, rows)
+        else:
+            with open(output, 'w', newline='', encoding='utf-8') as file:
+                write_rows(file, format, dataset.fields, rows)
+        elapsed = time.monotonic() - started
+
+        self.stderr.write(
+            f"Exported {rows.n} {options['dataset']} in {elapsed:.1f}s ({rows.n / max(elapsed, 1e-9):.0f} rows/s)."
+        )
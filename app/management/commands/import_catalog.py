@@ -0,0 +1,45 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+from app.catalog_io import DATASETS, FORMATS, batched, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert categories (by slug), products (by brand and model) or images (by product and file name) "
+        "from a JSONL or CSV file. Import categories before products and products before images."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=DATASETS)
+        parser.add_argument('input')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the input file's extension.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['input']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        dataset = DATASETS[options['dataset']]()
+        created = updated = skipped = 0
+
+        started = time.monotonic()
+        with open(path, newline='', encoding='utf-8') as file:
+            rows = tqdm(read_rows(file, format), unit='rows', disable=options['verbosity'] == 0)
+            for offset, batch in enumerate(batched(rows, options['batch_size'])):
+                batch_created, batch_updated, errors = dataset.import_batch(batch)
+                created += batch_created
+                updated += batch_updated
+                skipped += len(errors)
+                for index, message in errors:
+                    tqdm.write(f"Row {offset * options['batch_size'] + index + 1}: {message}", file=sys.stderr)
+        dataset.finish()
+        elapsed = time.monotonic() - started
+
+        total = created + updated + skipped
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {options['dataset']}: {created} created, {updated} updated, {skipped} skipped "
+            f"in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)."
+        ))
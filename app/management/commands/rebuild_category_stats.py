@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.stats import refresh_category_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute every CategoryStats row from the product table."
+
+    def handle(self, *args, **options):
+        rebuilt = refresh_category_stats()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {rebuilt} categories."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from app.cache import bump_namespace
+from app.models import Like, Product
+from app.stats import refresh_category_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.like_count from the Like table, and the categories' total_likes from it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Number of products updated per statement (by id range).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        likes = Like.objects.filter(product=OuterRef('pk')) \
+            .order_by() \
+            .values('product') \
+            .annotate(total=Count('pk')) \
+            .values('total')
+
+        last_id = Product.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        updated = 0
+        for start in range(0, last_id + 1, batch_size):
+            updated += Product.objects.filter(pk__gte=start, pk__lt=start + batch_size) \
+                .update(like_count=Coalesce(Subquery(likes), 0))
+        refresh_category_stats()
+        # QuerySet.update() skips the signals that drop the cached pages
+        bump_namespace('product', 'category', 'like')
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt like_count for {updated} products."))
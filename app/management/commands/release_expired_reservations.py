@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from app.stock import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Return the stock of cart items left untouched for longer than CART_RESERVATION_TTL. "
+        "The items stay in their carts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, help="Override CART_RESERVATION_TTL (seconds).")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--interval', type=int,
+            help="Keep running and sweep every INTERVAL seconds instead of once.",
+        )
+
+    def handle(self, *args, **options):
+        ttl = timedelta(seconds=options['ttl']) if options['ttl'] else None
+        while True:
+            released = release_expired(ttl=ttl, batch_size=options['batch_size'])
+            self.stdout.write(f"Released {released} expired cart items.")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
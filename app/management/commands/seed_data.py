@@ -0,0 +1,150 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.cache import bump_namespace
+from app.models import Cart, CartItem, Category, Comment, CustomUser, Image, Like, Product
+from app.search import build_search_document
+from app.signals import refresh_primary_images
+from app.stats import refresh_category_stats
+
+SEED_PASSWORD = 'seed-password'
+BRANDS = ['Apple', 'Samsung', 'Xiaomi', 'Huawei', 'Lenovo', 'Sony', 'LG', 'Artel', 'Philips', 'Bosch']
+WORDS = (
+    'fast charging display battery camera memory wireless smart compact premium silver black '
+    'warranty original sensor stereo portable durable lightweight ultra pro max mini'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert synthetic users, categories, products, images, likes, comments and carts for load tests. "
+        f"Seeded users log in with the password '{SEED_PASSWORD}'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--images-per-product', type=int, default=3)
+        parser.add_argument('--likes', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--cart-items', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, help="Random seed, for repeatable volumes and distributions.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Keeps names unique when seeding the same database more than once
+        self.run = uuid.uuid4().hex[:6]
+
+        started = time.monotonic()
+        with transaction.atomic():
+            users = self.seed_users(options['users'])
+            categories = self.seed_categories(options['categories'])
+            products = self.seed_products(options['products'], categories)
+            self.seed_images(products, options['images_per_product'])
+            self.seed_likes(users, products, options['likes'])
+            self.seed_comments(users, products, options['comments'])
+            self.seed_cart_items(users, products, options['cart_items'])
+
+            # Bulk inserts skip the signals that maintain the derived data
+            call_command('rebuild_like_counts', stdout=self.stdout)
+            refresh_primary_images()
+            refresh_category_stats()
+        bump_namespace('product', 'category', 'image', 'like')
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.monotonic() - started:.1f}s."))
+
+    def report(self, name, count):
+        self.stdout.write(f"{count} {name}")
+
+    def seed_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'seed-{self.run}-{i}', name=f'Seed user {i}', password=password)
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        user_ids = list(
+            CustomUser.objects.filter(username__startswith=f'seed-{self.run}-').values_list('pk', flat=True)
+        )
+        Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids], batch_size=self.batch_size)
+        self.report('users', len(users))
+        return user_ids
+
+    def seed_categories(self, count):
+        Category.objects.bulk_create([
+            Category(name=f'Category {self.run} {i}', slug=f'seed-{self.run}-{i}', image='category/images/seed.jpg')
+            for i in range(count)
+        ])
+        category_ids = list(
+            Category.objects.filter(slug__startswith=f'seed-{self.run}-').values_list('pk', flat=True)
+        )
+        self.report('categories', len(category_ids))
+        return category_ids
+
+    def seed_products(self, count, categories):
+        rng = self.random
+        products = []
+        for i in range(count):
+            product = Product(
+                category_id=rng.choice(categories),
+                name=' '.join(rng.sample(WORDS, 3)).title(),
+                description=' '.join(rng.choices(WORDS, k=40)),
+                price=round(rng.lognormvariate(5, 1.2), 2),
+                # A tenth of the catalog is sold out
+                stock=0 if rng.random() < .1 else rng.randint(1, 500),
+                brand=rng.choice(BRANDS),
+                model=f'{self.run.upper()}-{i}',
+            )
+            product.search_document = build_search_document(product)
+            products.append(product)
+        Product.objects.bulk_create(products, batch_size=self.batch_size)
+        product_ids = list(
+            Product.objects.filter(model__startswith=f'{self.run.upper()}-').values_list('pk', flat=True)
+        )
+        self.report('products', len(product_ids))
+        return product_ids
+
+    def seed_images(self, products, per_product):
+        Image.objects.bulk_create((
+            Image(product_id=product_id, image=f'product/images/seed-{order}.jpg', order=order)
+            for product_id in products for order in range(per_product)
+        ), batch_size=self.batch_size)
+        self.report('images', len(products) * per_product)
+
+    def sample_pairs(self, users, products, count):
+        # Distinct (user, product) pairs, for the unique constraints
+        count = min(count, len(users) * len(products))
+        for index in self.random.sample(range(len(users) * len(products)), count):
+            yield users[index // len(products)], products[index % len(products)]
+
+    def seed_likes(self, users, products, count):
+        likes = [Like(user_id=user, product_id=product) for user, product in self.sample_pairs(users, products, count)]
+        Like.objects.bulk_create(likes, batch_size=self.batch_size)
+        self.report('likes', len(likes))
+
+    def seed_comments(self, users, products, count):
+        rng = self.random
+        Comment.objects.bulk_create((
+            Comment(user_id=rng.choice(users), product_id=rng.choice(products),
+                    comment=' '.join(rng.choices(WORDS, k=rng.randint(3, 30))))
+            for _ in range(count)
+        ), batch_size=self.batch_size)
+        self.report('comments', count)
+
+    def seed_cart_items(self, users, products, count):
+        # Seeded quantities aren't taken from stock: seeded stock is what's left
+        carts = dict(Cart.objects.filter(user_id__in=users).values_list('user_id', 'pk'))
+        items = [
+            CartItem(cart_id=carts[user], product_id=product, quantity=self.random.randint(1, 3))
+            for user, product in self.sample_pairs(users, products, count)
+        ]
+        CartItem.objects.bulk_create(items, batch_size=self.batch_size)
+        self.report('cart items', len(items))
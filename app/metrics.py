@@ -0,0 +1,253 @@
+"""
+In-process metrics, aggregated across worker processes.
+
+Each process counts into its own Registry and every METRICS_FLUSH_INTERVAL
+seconds writes it to a file of its own in METRICS_DIR. The metrics endpoint
+adds up the files of every process, past and present, so the totals keep
+growing across worker restarts the way Prometheus counters should. Files of
+exited processes are folded into one retired file per host as they're found,
+so the directory doesn't grow with every restart.
+"""
+import fcntl
+import json
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+POOL_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Request latency by view and action.", LATENCY_BUCKETS),
+    'db_queries_per_request': ('histogram', "SQL queries per request by view and action.", QUERY_BUCKETS),
+    'response_cache_requests_total': ('counter', "Cached page lookups by viewset and result.", None),
+    'auth_failures_total': ('counter', "Responses refused with 401 or 403 by view and status.", None),
+    'db_connections_total': ('counter', "Connections set up by database, pool checkouts included.", None),
+    'db_pool_requests_total': ('counter', "Connections asked of the pool by database.", None),
+    'db_pool_wait_seconds_total': ('counter', "Time spent waiting for a pooled connection by database.", None),
+    'db_pool_timeouts_total': ('counter', "Requests for a pooled connection that failed or timed out.", None),
+    'db_pool_connections_in_use': (
+        'histogram', "Pooled connections in use in the process, sampled after each request.", POOL_BUCKETS,
+    ),
+}
+
+
+HOST = socket.gethostname()
+# {host}-{pid}-{id}.json, the retired file of a host is {host}-retired.json
+PROCESS_FILE = re.compile(r'^(?P<host>.+)-(?P<pid>\d+)-[0-9a-f]{8}\.json$')
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+        self.flushed_at = 0.0
+        self.pid = os.getpid()
+        # Unique per process, so a reused pid never overwrites an old file;
+        # the host tells which files this host can check the pid of
+        self.path = os.path.join(settings.METRICS_DIR, f'{HOST}-{self.pid}-{uuid.uuid4().hex[:8]}.json')
+
+    def inc(self, name, labels, value=1):
+        key = _labels_key(labels)
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = _labels_key(labels)
+        with self.lock:
+            series = self.values[name].get(key)
+            if series is None:
+                series = self.values[name][key] = {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def flush(self):
+        with self.lock:
+            data = json.dumps(self.values)
+            self.flushed_at = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _write(self.path, data)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def registry():
+    global _registry
+    # Also replaces a registry inherited through fork from the gunicorn master
+    if _registry is None or _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                _registry = Registry()
+    return _registry
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    registry().inc('db_connections_total', {'database': connection.alias})
+
+
+def record_database_pools(registry):
+    """
+    Moves the statistics psycopg_pool kept since the last call into the
+    registry, for the databases using a connection pool.
+    """
+    for connection in connections.all(initialized_only=True):
+        if not connection.settings_dict['OPTIONS'].get('pool'):
+            continue
+        stats = connection.pool.pop_stats()
+        labels = {'database': connection.alias}
+        registry.inc('db_pool_requests_total', labels, stats.get('requests_num', 0))
+        registry.inc('db_pool_wait_seconds_total', labels, stats.get('requests_wait_ms', 0) / 1000)
+        registry.inc('db_pool_timeouts_total', labels, stats.get('requests_errors', 0))
+        registry.observe('db_pool_connections_in_use', labels, stats['pool_size'] - stats['pool_available'])
+
+
+def _write(path, data):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+def _load(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(totals, values):
+    for name, series in values.items():
+        if name not in totals:
+            continue
+        for key, value in series.items():
+            current = totals[name].get(key)
+            if METRICS[name][0] == 'counter':
+                totals[name][key] = (current or 0) + value
+            elif current is None:
+                totals[name][key] = dict(value)
+            else:
+                current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                current['sum'] += value['sum']
+                current['count'] += value['count']
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock():
+    with open(os.path.join(settings.METRICS_DIR, '.lock'), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def retire_exited_processes():
+    """
+    Adds the files of this host's exited processes to the host's retired
+    file and removes them.
+    """
+    with _directory_lock():
+        exited = []
+        for filename in os.listdir(settings.METRICS_DIR):
+            match = PROCESS_FILE.match(filename)
+            if match and match['host'] == HOST and not _is_running(int(match['pid'])):
+                exited.append(os.path.join(settings.METRICS_DIR, filename))
+        if not exited:
+            return
+        retired_path = os.path.join(settings.METRICS_DIR, f'{HOST}-retired.json')
+        retired = {name: {} for name in METRICS}
+        for path in (retired_path, *exited):
+            values = _load(path)
+            if values is not None:
+                _add(retired, values)
+        _write(retired_path, json.dumps(retired))
+        for path in exited:
+            os.remove(path)
+
+
+def collect():
+    """
+    The sum of every process' last flushed values, this process' are flushed first.
+    """
+    registry().flush()
+    retire_exited_processes()
+    totals = {name: {} for name in METRICS}
+    for filename in os.listdir(settings.METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        values = _load(os.path.join(settings.METRICS_DIR, filename))
+        if values is not None:
+            _add(totals, values)
+    return totals
+
+
+def _format_labels(key, **extra):
+    labels = [*json.loads(key), *extra.items()]
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(totals):
+    """
+    Prometheus text exposition format.
+    """
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for key, value in sorted(totals[name].items()):
+            if kind == 'counter':
+                lines.append(f'{name}{_format_labels(key)} {_format_number(value)}')
+                continue
+            for bound, count in zip(buckets, value['buckets']):
+                lines.append(f'{name}_bucket{_format_labels(key, le=bound)} {count}')
+            lines.append(f'{name}_bucket{_format_labels(key, le="+Inf")} {value["count"]}')
+            lines.append(f'{name}_sum{_format_labels(key)} {_format_number(value["sum"])}')
+            lines.append(f'{name}_count{_format_labels(key)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
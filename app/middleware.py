@@ -0,0 +1,223 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from app import metrics
+from app.cache_backends import request_cache_counts
+from app.routers import pin_to_primary, stickiness_key
+
+logger = logging.getLogger('app.requests')
+
+
+def view_labels(request):
+    """
+    The view class (or function) and DRF action that served the request.
+    """
+    method = request.method.lower()
+    match = request.resolver_match
+    if match is None:
+        return {'view': 'unresolved', 'action': method}
+    view = getattr(match.func, 'cls', None) or match.func
+    # ViewSet.as_view() keeps its method -> action mapping on the function
+    actions = getattr(match.func, 'actions', None) or {}
+    return {'view': view.__name__, 'action': actions.get(method, method)}
+
+
+class QueryTimer:
+    """
+    Execute wrapper counting the queries run through it and their total time.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+# QueryTimer of the current request. A context variable rather than a
+# per-request execute_wrapper() because connections are thread-local: async
+# views query from sync_to_async threads, which the context is copied to.
+request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    timer = request_queries.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@receiver(connection_created)
+def time_new_connection(sender, connection, **kwargs):
+    install_query_timer(connection)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records SQL query count and time, default cache hits and misses, view time
+    and total time of every request. They're logged as one JSON line on the
+    `app.requests` logger, at INFO or as a warning when the route (URL name)
+    ran more queries than QUERY_BUDGETS allows it, and sent back in a
+    Server-Timing header with SERVER_TIMING_HEADER. Latency, query counts, page cache results and
+    auth failures also go to the metrics registry (app/metrics.py), with the
+    connection pool statistics.
+
+    Cheap enough to stay on in production: one execute wrapper call per query
+    and a few timer reads per request, and async under ASGI so it doesn't
+    push async views into a thread. Queries run while a streaming response
+    is consumed happen after the middleware and aren't counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django would run a sync process_view through sync_to_async
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+        started = time.perf_counter()
+        with self.measure() as (queries, cache_counts):
+            response = self.get_response(request)
+        self.finish(request, response, started, queries, cache_counts)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with self.measure() as (queries, cache_counts):
+            response = await self.get_response(request)
+        self.finish(request, response, started, queries, cache_counts)
+        return response
+
+    @contextmanager
+    def measure(self):
+        queries = QueryTimer()
+        cache_counts = {'hits': 0, 'misses': 0}
+        queries_token = request_queries.set(queries)
+        cache_token = request_cache_counts.set(cache_counts)
+        try:
+            yield queries, cache_counts
+        finally:
+            request_cache_counts.reset(cache_token)
+            request_queries.reset(queries_token)
+
+    def finish(self, request, response, started, queries, cache_counts):
+        finished = time.perf_counter()
+        total_ms = (finished - started) * 1000
+
+        view_started = getattr(request, 'metrics_view_started', None)
+        view_ms = (finished - view_started) * 1000 if view_started is not None else 0.0
+        db_ms = queries.duration * 1000
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={db_ms:.1f};desc="{queries.count} queries"',
+                f'cache;desc="{cache_counts["hits"]} hits, {cache_counts["misses"]} misses"',
+                f'view;dur={view_ms:.1f}',
+                f'total;dur={total_ms:.1f}',
+            ])
+
+        match = request.resolver_match
+        route = match.view_name if match else None
+        budget = settings.QUERY_BUDGETS.get(route, settings.DEFAULT_QUERY_BUDGET)
+        over_budget = budget is not None and queries.count > budget
+        level = logging.WARNING if over_budget else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'route': route,
+                'status': response.status_code,
+                'queries': queries.count,
+                'query_budget': budget,
+                'over_budget': over_budget,
+                'db_ms': round(db_ms, 2),
+                'cache_hits': cache_counts['hits'],
+                'cache_misses': cache_counts['misses'],
+                'view_ms': round(view_ms, 2),
+                'total_ms': round(total_ms, 2),
+            }))
+
+        self.record_metrics(request, response, total_ms / 1000, queries.count)
+
+    def record_metrics(self, request, response, duration, query_count):
+        registry = metrics.registry()
+        labels = view_labels(request)
+        registry.observe('http_request_duration_seconds', labels, duration)
+        registry.observe('db_queries_per_request', labels, query_count)
+        response_cache = getattr(request, 'response_cache', None)
+        if response_cache and request.method in ('GET', 'HEAD'):
+            registry.inc('response_cache_requests_total', {'viewset': labels['view'], 'result': response_cache})
+        if response.status_code in (401, 403):
+            registry.inc('auth_failures_total', {'view': labels['view'], 'status': str(response.status_code)})
+        metrics.record_database_pools(registry)
+        registry.maybe_flush()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view_started = time.perf_counter()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view_started = time.perf_counter()
+
+
+class PrimaryStickinessMiddleware:
+    """
+    Keeps a user (or session) whose request wrote something (a like, cart
+    item, favorite...) reading from the primary for REPLICA_STICKY_SECONDS,
+    so they see their own write even when the replicas lag behind.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            self.pin_user(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            # Reading a session user may query the database
+            await sync_to_async(self.pin_user)(request)
+        return response
+
+    def wrote(self, request, response):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400
+
+    def pin_user(self, request):
+        # DRF sets the user it authenticated (e.g. from a JWT) on the request too
+        pin_to_primary(stickiness_key(request))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_primary_image(apps, schema_editor):
+    Image = apps.get_model("app", "Image")
+    Product = apps.get_model("app", "Product")
+    first_image = (
+        Image.objects.filter(product=OuterRef("pk"))
+        .order_by("order", "pk")
+        .values("pk")[:1]
+    )
+    Product.objects.update(primary_image=Subquery(first_image))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0002_product_like_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="primary_image",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="app.image",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(
+                fields=["product", "order"], name="app_image_product_4d4f35_idx"
+            ),
+        ),
+        migrations.RunPython(populate_primary_image, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:40
+
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Concat
+
+INDEX_NAME = "app_product_search_gin"
+
+
+def populate_search_document(apps, schema_editor):
+    Product = apps.get_model("app", "Product")
+    Product.objects.update(
+        search_document=Concat(
+            "name", Value(" "),
+            "brand", Value(" "),
+            "model", Value(" "),
+            Coalesce("description", Value("")),
+            output_field=models.TextField(),
+        )
+    )
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON app_product "
+        f"USING gin (to_tsvector('simple'::regconfig, search_document))"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_cartitem_reserved_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_document",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(populate_search_document, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
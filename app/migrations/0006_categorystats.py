@@ -0,0 +1,64 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_category_stats(apps, schema_editor):
+    Category = apps.get_model("app", "Category")
+    CategoryStats = apps.get_model("app", "CategoryStats")
+    rows = Category.objects.order_by().annotate(
+        product_count=Count("product"),
+        in_stock_count=Count("product", filter=Q(product__stock__gt=0)),
+        min_price=Min("product__price"),
+        max_price=Max("product__price"),
+        total_likes=Coalesce(Sum("product__like_count"), 0),
+    ).values(
+        "pk", "product_count", "in_stock_count", "min_price", "max_price", "total_likes"
+    )
+    CategoryStats.objects.bulk_create(
+        [CategoryStats(category_id=row.pop("pk"), **row) for row in rows]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_product_search_document"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CategoryStats",
+            fields=[
+                (
+                    "category",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="app.category",
+                    ),
+                ),
+                ("product_count", models.PositiveIntegerField(default=0)),
+                ("in_stock_count", models.PositiveIntegerField(default=0)),
+                (
+                    "min_price",
+                    models.DecimalField(decimal_places=2, max_digits=12, null=True),
+                ),
+                (
+                    "max_price",
+                    models.DecimalField(decimal_places=2, max_digits=12, null=True),
+                ),
+                ("total_likes", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "Category stats",
+            },
+        ),
+        migrations.RunPython(populate_category_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0007_category_updated_at_product_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cartitem",
+            name="reserved",
+            field=models.BooleanField(default=True),
+        ),
+    ]
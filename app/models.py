@@ -1,13 +1,17 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.utils.text import slugify
 
+from app.search import build_search_document, SEARCH_FIELDS
+
 
 # Category
 class Category(models.Model):
     name = models.CharField(max_length=100, db_index=True)
     image = models.ImageField(upload_to='category/images/')
     slug = models.SlugField(max_length=100, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -17,6 +21,9 @@ class Category(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+    def total_likes(self):
+        return self.product_set.aggregate(total=Sum('like_count'))['total'] or 0
+
     class Meta:
         verbose_name_plural = 'Categories'
         indexes = [
@@ -25,6 +32,27 @@ class Category(models.Model):
         ordering = ['name']
 
 
+# CategoryStats
+class CategoryStats(models.Model):
+    """
+    Per-category aggregates kept up to date by app/stats.py, rebuild with
+    `manage.py rebuild_category_stats`.
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    product_count = models.PositiveIntegerField(default=0)
+    in_stock_count = models.PositiveIntegerField(default=0)
+    min_price = models.DecimalField(decimal_places=2, max_digits=12, null=True)
+    max_price = models.DecimalField(decimal_places=2, max_digits=12, null=True)
+    total_likes = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Category stats'
+
+    def __str__(self):
+        return f"{self.category} stats"
+
+
 # Product
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
@@ -34,20 +62,46 @@ class Product(models.Model):
     stock = models.PositiveIntegerField()
     brand = models.CharField(max_length=100)
     model = models.CharField(max_length=100)
+    # Maintained by the Like signals, rebuild with `manage.py rebuild_like_counts`
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    # First image by `order`, kept in sync by the Image signals
+    primary_image = models.ForeignKey(
+        'app.Image', on_delete=models.SET_NULL, related_name='+', null=True, blank=True, editable=False
+    )
+    # name, brand, model and description, full-text indexed on PostgreSQL
+    search_document = models.TextField(blank=True, editable=False)
+    # Also touched by the UPDATEs that maintain stock and the denormalized
+    # fields, so it changes whenever the serialized product does
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    # Maintained with single UPDATE statements by the signals, a full save of
+    # an instance loaded earlier must not write back its stale values.
+    DENORMALIZED_FIELDS = ('like_count', 'primary_image')
+
+    def save(self, *args, **kwargs):
+        self.search_document = build_search_document(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
+        elif update_fields is not None:
+            update_fields = {*update_fields, 'updated_at'}
+            if update_fields & set(SEARCH_FIELDS):
+                update_fields.add('search_document')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
     @property
     def get_absolute_url(self):
-        images = self.images.all().order_by('order')
-        if images.exists():
-            return images[0].image.url
+        if self.primary_image_id:
+            return self.primary_image.image.url
         return ""
 
-    def total_likes(self):
-        return sum(product.likes_product.count() for product in self.product_set.all())
-
 
 # Image
 class Image(models.Model):
@@ -61,6 +115,9 @@ class Image(models.Model):
 
     class Meta:
         verbose_name_plural = 'Images'
+        indexes = [
+            models.Index(fields=['product', 'order']),
+        ]
 
 
 # Like
@@ -111,7 +168,7 @@ class Cart(models.Model):
         return f"{self.user.username}'s cart"
 
     def total_price(self):
-        return sum(item.product.price * item.quantity for item in self.items.all())
+        return self.items.aggregate(total=Sum(F('product__price') * F('quantity')))['total'] or 0
 
 
 # CartItem
@@ -119,6 +176,10 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # Stock stays reserved until the item is untouched for CART_RESERVATION_TTL;
+    # the line then stays in the cart, unreserved, until it's saved again
+    reserved_at = models.DateTimeField(auto_now=True, db_index=True)
+    reserved = models.BooleanField(default=True)
 
     class Meta:
         constraints = [
@@ -128,6 +189,15 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
 
+    def save(self, *args, **kwargs):
+        # The pre_save signal reserves stock (app/signals.py): a failing write,
+        # such as a second line for the same product, must give it back
+        self.reserved = True
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'reserved'}
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     def total_price(self):
         return self.product.price * self.quantity
 
@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.response import Response
 
 
@@ -17,3 +17,53 @@ class CustomPagination(PageNumberPagination):
             'results': data
 
         })
+
+
+class CustomCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key, so every page costs the same
+    regardless of depth. The total is only counted when `?count=true`.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = '-id'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.total = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.total = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.total is not None:
+            response['total'] = self.total
+        return Response(response)
+
+
+class CursorModePagination(CustomPagination):
+    """
+    Page-number pagination by default, cursor pagination when the request asks
+    for it with `?pagination=cursor` or carries a cursor from a previous page.
+    """
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CustomCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        params = request.query_params
+        if params.get(self.mode_query_param) == 'cursor' or self.cursor_pagination_class.cursor_query_param in params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
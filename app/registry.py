@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from app.cache import get_versions
+
+
+class CategoryRegistry:
+    """
+    Per-process store of serialized categories, so product pages embed a
+    ready-made category block instead of serializing it for every product.
+
+    Entries are keyed by the request's base URL (the image URL is absolute) and
+    category id. The `category` cache namespace version is compared at most
+    every CATEGORY_REGISTRY_CHECK_INTERVAL seconds, which bounds how long
+    another worker's category edit can go unseen; edits made in this process
+    clear the registry right away (see app/signals.py). The base URL comes from
+    the Host header, so entries are kept in an LRU of
+    CATEGORY_REGISTRY_MAX_ENTRIES.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.checked_at = 0.0
+
+    def get(self, request, category_id, build):
+        self._check_version()
+        key = (request.build_absolute_uri('/'), category_id)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                return data
+        data = dict(build())
+        with self.lock:
+            self.entries[key] = data
+            while len(self.entries) > settings.CATEGORY_REGISTRY_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.checked_at = 0.0
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self.checked_at < settings.CATEGORY_REGISTRY_CHECK_INTERVAL:
+            return
+        version, = get_versions(['category'])
+        with self.lock:
+            if version != self.version:
+                self.entries = OrderedDict()
+                self.version = version
+            self.checked_at = now
+
+
+category_registry = CategoryRegistry()
@@ -0,0 +1,82 @@
+"""
+Read-replica routing for the catalog.
+
+Reads are only sent to a replica inside `replica_reads()`, which the
+catalog viewsets enter for safe requests (see ReplicaReadsMixin in
+app/views.py); everything else stays on `default`. Replica lag is hidden
+twice: the user (or session) that has just written is kept on the primary
+for REPLICA_STICKY_SECONDS, and for that long after a catalog change the
+pages read from a replica aren't cached, so a stale read can't be stored
+under the new version.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from app.cache import shared_cache
+
+PINNED_KEY = 'primary-pin:{}'
+
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+@contextmanager
+def replica_reads():
+    """
+    Send the reads made in the block to one replica, picked at random.
+    """
+    if not settings.REPLICA_DATABASES:
+        yield None
+        return
+    alias = random.choice(settings.REPLICA_DATABASES)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def stickiness_key(request):
+    """
+    Who `request` reads and writes for: its user, else its session, None
+    when it has neither.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f'session:{session.session_key}'
+    return None
+
+
+def pin_to_primary(key):
+    if settings.REPLICA_DATABASES and key is not None:
+        shared_cache().set(PINNED_KEY.format(key), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(key):
+    return key is not None and shared_cache().get(PINNED_KEY.format(key), False)
+
+
+def recently_changed(modified):
+    """
+    Whether `modified`, a cache namespace modification time, is recent enough
+    that a replica may not have the change yet.
+    """
+    return modified is not None and time.time() - modified.timestamp() < settings.REPLICA_STICKY_SECONDS
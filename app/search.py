@@ -0,0 +1,45 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, Q, Value, When
+
+SEARCH_FIELDS = ('name', 'brand', 'model', 'description')
+SEARCH_CONFIG = 'simple'
+
+
+def build_search_document(product):
+    return ' '.join(str(getattr(product, field) or '') for field in SEARCH_FIELDS)
+
+
+class SearchDocumentVector(Func):
+    """
+    to_tsvector over Product.search_document, spelled exactly like the GIN
+    expression index created in migration 0005 so PostgreSQL can use it.
+    """
+    function = 'to_tsvector'
+    template = f"%(function)s('{SEARCH_CONFIG}'::regconfig, %(expressions)s)"
+    output_field = SearchVectorField()
+
+
+def search_products(queryset, query):
+    """
+    Filter `queryset` to products matching `query`, best matches first.
+
+    PostgreSQL uses the full-text index with websearch syntax and ts_rank.
+    Other databases (SQLite in tests) fall back to requiring every term in the
+    document, ranking name matches above the rest.
+    """
+    if connection.vendor == 'postgresql':
+        vector = SearchDocumentVector(F('search_document'))
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.alias(document=vector) \
+            .filter(document=search_query) \
+            .annotate(rank=SearchRank(vector, search_query)) \
+            .order_by('-rank', '-id')
+
+    condition = Q()
+    for term in query.split():
+        condition &= Q(search_document__icontains=term)
+    return queryset.filter(condition) \
+        .annotate(rank=Case(When(name__icontains=query, then=Value(1.0)), default=Value(0.0),
+                            output_field=FloatField())) \
+        .order_by('-rank', '-id')
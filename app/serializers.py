@@ -1,7 +1,12 @@
+from decimal import Decimal
+
 from django.contrib.auth import get_user_model
+from django.db.models import Sum
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from app.models import Category, Product, Like, Favorite, Comment, CartItem, Cart, CustomUser
+from app.models import Category, CategoryStats, Product, Image, Like, Favorite, Comment, CartItem, Cart, CustomUser
+from app.registry import category_registry
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -9,30 +14,122 @@ class CategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = "__all__"
+        # Sent as the Last-Modified header instead, see app/views.py
+        exclude = ['updated_at']
 
     def get_category_name(self, obj):
         return obj.name.upper()
 
 
+@extend_schema_field(CategorySerializer)
+class RegisteredCategoryField(serializers.Field):
+    """
+    Read-only CategorySerializer output, taken from the per-process registry.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, category):
+        request = self.context.get('request')
+        if request is None:
+            return CategorySerializer(category, context=self.context).data
+        return category_registry.get(
+            request, category.pk, lambda: CategorySerializer(category, context={'request': request}).data
+        )
+
+
+class CategoryStatsSerializer(serializers.ModelSerializer):
+    category_name = serializers.CharField(source='category.name', read_only=True)
+
+    class Meta:
+        model = CategoryStats
+        fields = ['category', 'category_name', 'product_count', 'in_stock_count', 'min_price', 'max_price',
+                  'total_likes', 'updated_at']
+
+
 class ProductSerializer(serializers.ModelSerializer):
     is_liked = serializers.SerializerMethodField()
-    like_count = serializers.SerializerMethodField()
-    category = CategorySerializer(read_only=True)
+    like_count = serializers.IntegerField(read_only=True)
+    category = RegisteredCategoryField()
+    primary_image = serializers.ImageField(source='primary_image.image', read_only=True, allow_null=True)
 
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ['search_document', 'updated_at']
 
     def get_is_liked(self, obj):
         user = self.context.get('request').user
         if not user.is_authenticated:
             return False
 
-        return any(like.user_id == user.id for like in obj.likes_product.all())
-
-    def get_like_count(self, obj):
-        return getattr(obj, 'like_count', obj.likes_product.count())
+        # Filled in for the whole page by LikedProductsMixin in app/views.py
+        liked_product_ids = self.context.get('liked_product_ids')
+        if liked_product_ids is not None:
+            return obj.pk in liked_product_ids
+        return obj.likes_product.filter(user=user).exists()
+
+
+class FastProductListSerializer:
+    """
+    Read-only stand-in for ``ProductSerializer(many=True)`` that builds the same
+    JSON from ``values(*value_fields)`` rows, skipping DRF's per-field work.
+    Any change to ProductSerializer's output must be mirrored here, the parity
+    test in app/tests.py compares the two.
+    """
+    value_fields = (
+        'id', 'like_count', 'name', 'description', 'price', 'stock', 'brand', 'model',
+        'category_id', 'category__name', 'category__image', 'category__slug', 'primary_image__image',
+    )
+    price_places = Decimal('0.01')
+
+    def __init__(self, rows, context):
+        self.rows = rows
+        self.context = context
+
+    @property
+    def data(self):
+        request = self.context['request']
+        liked_product_ids = self.context.get('liked_product_ids') or ()
+        is_authenticated = request.user.is_authenticated
+        category_storage = Category._meta.get_field('image').storage
+        image_storage = Image._meta.get_field('image').storage
+        categories = {}
+
+        def url(storage, name):
+            return request.build_absolute_uri(storage.url(name)) if name else None
+
+        def build_category(row):
+            return {
+                'id': row['category_id'],
+                'category_name': row['category__name'].upper(),
+                'name': row['category__name'],
+                'image': url(category_storage, row['category__image']),
+                'slug': row['category__slug'],
+            }
+
+        results = []
+        for row in self.rows:
+            category = categories.get(row['category_id'])
+            if category is None:
+                category = categories[row['category_id']] = category_registry.get(
+                    request, row['category_id'], lambda: build_category(row)
+                )
+            results.append({
+                'id': row['id'],
+                'is_liked': is_authenticated and row['id'] in liked_product_ids,
+                'like_count': row['like_count'],
+                'category': category,
+                'primary_image': url(image_storage, row['primary_image__image']),
+                'name': row['name'],
+                'description': row['description'],
+                'price': format(row['price'].quantize(self.price_places), 'f'),
+                'stock': row['stock'],
+                'brand': row['brand'],
+                'model': row['model'],
+            })
+        return results
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -61,10 +158,16 @@ class CommentSerializer(serializers.ModelSerializer):
         model = Comment
         fields = ['id', 'user', 'product', 'comment', 'created_at', 'like_count', 'is_liked']
 
+    # CommentViewSet annotates both values for the whole page, the queries
+    # below only run for comments serialized outside of it.
     def get_like_count(self, obj):
+        if hasattr(obj, 'like_count'):
+            return obj.like_count
         return obj.likes.count()
 
     def get_is_liked(self, obj):
+        if hasattr(obj, 'is_liked'):
+            return obj.is_liked
         user = self.context.get('request').user
         return obj.likes.filter(user=user).exists() if user.is_authenticated else False
 
@@ -78,21 +181,48 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'product_id', 'quantity', 'total_price']
+        fields = ['id', 'product', 'product_id', 'quantity', 'reserved', 'total_price']
+        read_only_fields = ['reserved']
 
     def get_total_price(self, obj):
+        if hasattr(obj, 'line_total'):
+            return obj.line_total
         return obj.total_price()
 
 
+class CartBulkLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class CartBulkSerializer(serializers.Serializer):
+    items = CartBulkLineSerializer(many=True, allow_empty=False, max_length=200)
+
+    def validate_items(self, items):
+        product_ids = [item['product_id'] for item in items]
+        if len(product_ids) != len(set(product_ids)):
+            raise serializers.ValidationError("Each product may appear only once.")
+        return items
+
+
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(read_only=True, many=True)
+    item_count = serializers.SerializerMethodField()
     total_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total_price', 'created_at']
+        fields = ['id', 'user', 'items', 'item_count', 'total_price', 'created_at']
+
+    # CartViewSet annotates both, the fallbacks cover freshly created carts
+    def get_item_count(self, obj):
+        if hasattr(obj, 'item_count'):
+            return obj.item_count
+        return obj.items.aggregate(count=Sum('quantity'))['count'] or 0
 
     def get_total_price(self, obj):
+        if hasattr(obj, 'subtotal'):
+            return obj.subtotal
         return obj.total_price()
 
 
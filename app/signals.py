@@ -1,8 +1,15 @@
 from django.conf import settings
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete
+from django.db.transaction import TransactionManagementError
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .models import CartItem, Cart
+from . import stats, stock
+from .cache import PRODUCT_LIKES_NAMESPACE, bump_namespace, invalidate_cart_summary, invalidate_principal
+from .models import CartItem, Cart, Product, Category, CategoryStats, Image, Like
+from .registry import category_registry
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -11,18 +18,169 @@ def create_cart_for_new_user(sender, instance, created, **kwargs):
         Cart.objects.create(user=instance)
 
 
+# Covers profile updates, password changes and deactivation. Dropped at once
+# and again on commit, in case a request cached the old row in between.
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def drop_cached_principal(sender, instance, **kwargs):
+    user_id = instance.pk
+    invalidate_principal(user_id)
+    transaction.on_commit(lambda: invalidate_principal(user_id))
+
+
 @receiver(pre_save, sender=CartItem)
-def update_product_stock(sender, instance, **kwargs):
+def update_product_stock(sender, instance, using, **kwargs):
+    # CartItem.save() opens one, so the reservation is undone with a failed write
+    if not transaction.get_connection(using).in_atomic_block:
+        raise TransactionManagementError("Cart items must be saved inside a transaction.")
     if not instance.pk:
         # New CartItem
-        if instance.product.stock < instance.quantity:
-            raise ValueError("There is not enough product stock available.")
-        instance.product.stock -= instance.quantity
+        stock.reserve(instance.product_id, instance.quantity)
     else:
         # Existing CartItem being updated
-        old_quantity = CartItem.objects.get(pk=instance.pk).quantity
-        difference = instance.quantity - old_quantity
-        if instance.product.stock < difference:
-            raise ValueError("There is not enough product stock.")
-        instance.product.stock -= difference
-    instance.product.save()
+        old_product_id, old_quantity = stock.current_reservation(instance.pk)
+        stock.rereserve(old_product_id, old_quantity, instance.product_id, instance.quantity)
+
+
+@receiver(pre_delete, sender=CartItem)
+def remember_reservation(sender, instance, **kwargs):
+    # From the row: the instance may predate release_expired() unreserving it
+    instance._reservation = stock.current_reservation(instance.pk)
+
+
+@receiver(post_delete, sender=CartItem)
+def release_product_stock(sender, instance, **kwargs):
+    product_id, quantity = getattr(instance, '_reservation', (instance.product_id, instance.quantity))
+    stock.release(product_id, quantity)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def drop_cart_summary(sender, instance, **kwargs):
+    if CartItem.cart.is_cached(instance):
+        user_id = instance.cart.user_id
+    else:
+        user_id = Cart.objects.filter(pk=instance.cart_id).values_list('user_id', flat=True).first()
+    transaction.on_commit(lambda: invalidate_cart_summary(user_id))
+
+
+# Both run inside the transaction that creates or deletes the Like
+# (get_or_create and the delete collector are atomic), and the counter is
+# updated in a single UPDATE so concurrent likes can't lose increments.
+@receiver(post_save, sender=Like)
+def increment_product_like_count(sender, instance, created, **kwargs):
+    if created:
+        Product.objects.filter(pk=instance.product_id) \
+            .update(like_count=F('like_count') + 1, updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Like)
+def decrement_product_like_count(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id, like_count__gt=0) \
+        .update(like_count=F('like_count') - 1, updated_at=timezone.now())
+
+
+def refresh_primary_image(product_id):
+    first_image = Image.objects.filter(product_id=product_id) \
+        .order_by('order', 'pk') \
+        .values_list('pk', flat=True) \
+        .first()
+    Product.objects.filter(pk=product_id).update(primary_image_id=first_image, updated_at=timezone.now())
+
+
+def refresh_primary_images(product_ids=None):
+    """
+    refresh_primary_image for many products (all when None) in one UPDATE,
+    for bulk writes that don't send the Image signals.
+    """
+    first_image = Image.objects.filter(product=OuterRef('pk')).order_by('order', 'pk').values('pk')[:1]
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    return products.update(primary_image_id=Subquery(first_image), updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Image)
+def update_primary_image(sender, instance, **kwargs):
+    # Also covers an image moved to another product or reordered
+    stale = Product.objects.filter(primary_image=instance).exclude(pk=instance.product_id)
+    for product_id in [instance.product_id, *stale.values_list('pk', flat=True)]:
+        if product_id is not None:
+            refresh_primary_image(product_id)
+
+
+@receiver(post_delete, sender=Image)
+def replace_primary_image(sender, instance, **kwargs):
+    if instance.product_id is not None:
+        refresh_primary_image(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+def create_category_stats(sender, instance, created, **kwargs):
+    if created:
+        CategoryStats.objects.get_or_create(category=instance)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product(sender, instance, **kwargs):
+    instance._previous_row = None
+    if instance.pk:
+        instance._previous_row = Product.objects.filter(pk=instance.pk) \
+            .values('category_id', 'stock', 'price', 'like_count').first()
+
+
+@receiver(post_save, sender=Product)
+def update_category_stats(sender, instance, **kwargs):
+    stats.product_saved(instance, getattr(instance, '_previous_row', None))
+
+
+@receiver(post_delete, sender=Product)
+def recount_category_stats(sender, instance, **kwargs):
+    # Rare, and the instance's stock may be stale while the cascaded cart
+    # items and likes have already adjusted the stats: recount the category
+    category_id = instance.category_id
+    transaction.on_commit(lambda: stats.refresh_category_stats([category_id]))
+
+
+@receiver(post_save, sender=Like)
+def count_category_like(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust_likes(instance.product_id, 1)
+
+
+@receiver(post_delete, sender=Like)
+def uncount_category_like(sender, instance, **kwargs):
+    stats.adjust_likes(instance.product_id, -1)
+
+
+CACHE_NAMESPACES = {
+    Product: 'product',
+    Category: 'category',
+    Image: 'image',
+}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def invalidate_cached_pages(sender, **kwargs):
+    # Bump after commit, otherwise a concurrent read could cache the old rows
+    # under the new version.
+    namespace = CACHE_NAMESPACES[sender]
+    transaction.on_commit(lambda: bump_namespace(namespace))
+    if sender is Category:
+        # Other workers notice the bump within CATEGORY_REGISTRY_CHECK_INTERVAL
+        transaction.on_commit(category_registry.clear)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_liked_product_page(sender, instance, created=True, **kwargs):
+    # Only the product's like_count changed: its detail page goes, the lists
+    # keep theirs until they expire rather than all being dropped per like
+    if created:
+        namespace = PRODUCT_LIKES_NAMESPACE.format(instance.product_id)
+        transaction.on_commit(lambda: bump_namespace(namespace))
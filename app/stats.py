@@ -0,0 +1,139 @@
+from django.db.models import Case, Count, DecimalField, Max, Min, PositiveIntegerField, Q, Subquery, Sum, F, \
+    Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from app.models import Category, CategoryStats, Product
+
+STATS_FIELDS = ['product_count', 'in_stock_count', 'min_price', 'max_price', 'total_likes']
+
+
+def refresh_category_stats(category_ids=None):
+    """
+    Recompute the stats rows of the given categories (all when None) with one
+    grouped query and write them back as a single upsert.
+    """
+    categories = Category.objects.order_by()
+    if category_ids is not None:
+        categories = categories.filter(pk__in=[pk for pk in category_ids if pk is not None])
+    rows = categories.annotate(
+        product_count=Count('product'),
+        in_stock_count=Count('product', filter=Q(product__stock__gt=0)),
+        min_price=Min('product__price'),
+        max_price=Max('product__price'),
+        total_likes=Coalesce(Sum('product__like_count'), 0),
+    ).values('pk', *STATS_FIELDS)
+    stats = [
+        CategoryStats(category_id=row.pop('pk'), **row)
+        for row in rows
+    ]
+    CategoryStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=['category'], update_fields=[*STATS_FIELDS, 'updated_at'],
+    )
+    return len(stats)
+
+
+def _stats_of_product(product_id, **product_filter):
+    return CategoryStats.objects.filter(
+        category_id=Subquery(Product.objects.filter(pk=product_id, **product_filter).values('category_id'))
+    )
+
+
+def adjust_likes(product_id, difference):
+    stats = _stats_of_product(product_id)
+    if difference < 0:
+        stats = stats.filter(total_likes__gte=-difference)
+    stats.update(total_likes=F('total_likes') + difference)
+
+
+def stock_sold_out(product_id):
+    # Called in the reserving transaction once the product is at 0 (see
+    # stock.reserve), while its row is still locked by the decrement
+    _stats_of_product(product_id) \
+        .filter(in_stock_count__gt=0) \
+        .update(in_stock_count=F('in_stock_count') - 1)
+
+
+def stock_back(product_id):
+    # Likewise, once a release brought the product back from 0
+    _stats_of_product(product_id).update(in_stock_count=F('in_stock_count') + 1)
+
+
+# The functions below keep the stats of single products' writes up to date
+# with F() updates, inside the writing transaction; refresh_category_stats()
+# is for bulk writes and repairs.
+
+def _minus(field, amount):
+    return Greatest(F(field) - amount, Value(0), output_field=PositiveIntegerField())
+
+
+def _widened_prices(price):
+    price = Value(price, output_field=DecimalField(decimal_places=2, max_digits=12))
+    return {
+        'min_price': Least(Coalesce('min_price', price), price),
+        'max_price': Greatest(Coalesce('max_price', price), price),
+    }
+
+
+def _narrow_prices(category_id, price):
+    # Only losing the product at the min or max price can move them inward,
+    # and only that needs the category's prices scanned again
+    stats = CategoryStats.objects.filter(category_id=category_id)
+    if stats.filter(Q(min_price=price) | Q(max_price=price)).exists():
+        stats.update(**Product.objects.filter(category_id=category_id).aggregate(
+            min_price=Min('price'), max_price=Max('price'),
+        ))
+
+
+def adjust_in_stock(differences):
+    """
+    Add {category_id: difference} to the in_stock_count of the categories,
+    in a single UPDATE.
+    """
+    differences = {category_id: difference for category_id, difference in differences.items() if difference}
+    if not differences:
+        return
+    CategoryStats.objects.filter(category_id__in=differences).update(in_stock_count=Greatest(
+        Case(*[
+            When(category_id=category_id, then=F('in_stock_count') + difference)
+            for category_id, difference in differences.items()
+        ]),
+        Value(0),
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def product_added(category_id, stock, price, like_count):
+    CategoryStats.objects.filter(category_id=category_id).update(
+        product_count=F('product_count') + 1,
+        in_stock_count=F('in_stock_count') + int(stock > 0),
+        total_likes=F('total_likes') + like_count,
+        **_widened_prices(price),
+    )
+
+
+def product_removed(category_id, stock, price, like_count):
+    CategoryStats.objects.filter(category_id=category_id).update(
+        product_count=_minus('product_count', 1),
+        in_stock_count=_minus('in_stock_count', int(stock > 0)),
+        total_likes=_minus('total_likes', like_count),
+    )
+    _narrow_prices(category_id, price)
+
+
+def product_saved(product, previous):
+    """
+    Apply a saved product to the stats, `previous` being its row before the
+    save (category_id, stock, price and like_count), None for a new one.
+    """
+    if previous is None:
+        product_added(product.category_id, product.stock, product.price, product.like_count)
+        return
+    if previous['category_id'] != product.category_id:
+        # A full save never writes like_count, the row keeps the previous one
+        product_removed(previous['category_id'], previous['stock'], previous['price'], previous['like_count'])
+        product_added(product.category_id, product.stock, product.price, previous['like_count'])
+        return
+    adjust_in_stock({product.category_id: int(product.stock > 0) - int(previous['stock'] > 0)})
+    if product.price != previous['price']:
+        CategoryStats.objects.filter(category_id=product.category_id).update(**_widened_prices(product.price))
+        _narrow_prices(product.category_id, previous['price'])
@@ -0,0 +1,215 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+from django.utils import timezone
+
+from app import stats
+from app.cache import bump_namespace, invalidate_cart_summary
+from app.models import Product, CartItem
+
+
+class InsufficientStock(ValueError):
+    def __init__(self, product_id, quantity):
+        self.product_id = product_id
+        self.quantity = quantity
+        super().__init__(f"There is not enough stock of product {product_id} to reserve {quantity}.")
+
+
+def reserve(product_id, quantity):
+    """
+    Take `quantity` units of stock in a single conditional UPDATE, so concurrent
+    reservations can neither lose a decrement nor drive stock below zero.
+    """
+    if quantity <= 0:
+        return
+    # Keeps the row lock the stats update relies on, also when called alone
+    with transaction.atomic(savepoint=False):
+        updated = Product.objects.filter(pk=product_id, stock__gte=quantity) \
+            .update(stock=F('stock') - quantity, updated_at=timezone.now())
+        # Only the last units change what the catalog shows (in_stock)
+        if updated and Product.objects.filter(pk=product_id, stock=0).exists():
+            stats.stock_sold_out(product_id)
+            _stock_changed()
+    # Raised outside the block, which would otherwise doom the caller's transaction
+    if not updated:
+        raise InsufficientStock(product_id, quantity)
+
+
+def release(product_id, quantity):
+    if quantity <= 0:
+        return
+    with transaction.atomic(savepoint=False):
+        Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity, updated_at=timezone.now())
+        # Stock equal to what was just returned means it was out before
+        if Product.objects.filter(pk=product_id, stock=quantity).exists():
+            stats.stock_back(product_id)
+            _stock_changed()
+
+
+def rereserve(old_product_id, old_quantity, product_id, quantity):
+    if old_product_id != product_id:
+        reserve(product_id, quantity)
+        release(old_product_id, old_quantity)
+    elif quantity > old_quantity:
+        reserve(product_id, quantity - old_quantity)
+    else:
+        release(product_id, old_quantity - quantity)
+
+
+def current_reservation(cart_item_pk):
+    """
+    (product_id, quantity) reserved by a saved cart item, quantity 0 once it
+    expired, row-locked when called inside a transaction so concurrent edits
+    of the same item are serialized.
+    """
+    items = CartItem.objects.filter(pk=cart_item_pk)
+    if transaction.get_connection().in_atomic_block:
+        items = items.select_for_update()
+    row = items.values_list('product_id', 'quantity', 'reserved').first()
+    if row is None:
+        return None, 0
+    product_id, quantity, reserved = row
+    return product_id, quantity if reserved else 0
+
+
+def _stock_changed():
+    """
+    Called when products went in or out of stock. update() skips the Product
+    post_save that would invalidate cached pages; any other stock change is
+    left to show once the pages expire (CATALOG_CACHE_TIMEOUT), otherwise
+    every cart edit would empty the page cache.
+    """
+    transaction.on_commit(lambda: bump_namespace('product'))
+
+
+def release_expired(ttl=None, batch_size=500):
+    """
+    Give back the stock of cart items untouched for longer than `ttl`
+    (CART_RESERVATION_TTL by default). The items stay in their carts,
+    marked unreserved, and reserve again when next saved.
+    Returns the number of released items.
+    """
+    ttl = ttl or timedelta(seconds=settings.CART_RESERVATION_TTL)
+    cutoff = timezone.now() - ttl
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                CartItem.objects.filter(reserved=True, reserved_at__lt=cutoff)
+                .order_by('pk')
+                .select_for_update(skip_locked=True)
+                .values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            if not batch:
+                return released
+            quantities = defaultdict(int)
+            for _, product_id, quantity in batch:
+                quantities[product_id] += quantity
+            _restock(quantities)
+            CartItem.objects.filter(pk__in=[pk for pk, _, _ in batch]).update(reserved=False)
+        released += len(batch)
+
+
+def _restock(quantities):
+    """
+    Add {product_id: quantity} back to stock with one UPDATE.
+    """
+    locked = Product.objects.select_for_update().filter(pk__in=quantities) \
+        .values_list('pk', 'stock', 'category_id')
+    in_stock, crossed = defaultdict(int), False
+    for product_id, stock, category_id in locked:
+        change = int(stock + quantities[product_id] > 0) - int(stock > 0)
+        in_stock[category_id] += change
+        crossed = crossed or bool(change)
+    Product.objects.filter(pk__in=quantities).update(stock=Case(
+        *[When(pk=product_id, then=F('stock') + quantity) for product_id, quantity in quantities.items()],
+        output_field=PositiveIntegerField(),
+    ), updated_at=timezone.now())
+    if crossed:
+        _stock_changed()
+    stats.adjust_in_stock(in_stock)
+
+
+def apply_cart_lines(cart, lines):
+    """
+    Set the quantity of several products in `cart` at once, `lines` being
+    (product_id, quantity) pairs with quantity 0 meaning remove.
+
+    Stock of every product is read and locked in one query, items are written
+    with bulk_create/bulk_update and stock is moved with a single UPDATE.
+    Lines that can't be applied are reported and skipped.
+    """
+    results = []
+    with transaction.atomic():
+        product_ids = [product_id for product_id, quantity in lines]
+        locked = Product.objects.select_for_update().filter(pk__in=product_ids) \
+            .values_list('pk', 'stock', 'category_id')
+        available, categories = {}, {}
+        for product_id, stock, category_id in locked:
+            available[product_id] = stock
+            categories[product_id] = category_id
+        items = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=product_ids)
+        }
+        now = timezone.now()
+        to_create, to_update, to_delete, reserved = [], [], [], {}
+
+        for product_id, quantity in lines:
+            result = {'product_id': product_id, 'quantity': quantity}
+            results.append(result)
+            if product_id not in available:
+                result.update(status='error', error="Product not found.")
+                continue
+            item = items.get(product_id)
+            difference = quantity - (item.quantity if item and item.reserved else 0)
+            if difference > available[product_id]:
+                result.update(status='error', error=str(InsufficientStock(product_id, difference)))
+                continue
+
+            if item is None:
+                if quantity:
+                    to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+                result['status'] = 'created' if quantity else 'unchanged'
+            elif not quantity:
+                # Stock comes back through the CartItem post_delete signal
+                to_delete.append(item.pk)
+                result['status'] = 'removed'
+                continue
+            else:
+                item.quantity = quantity
+                item.reserved_at = now
+                item.reserved = True
+                to_update.append(item)
+                result['status'] = 'updated' if difference else 'unchanged'
+            if difference:
+                reserved[product_id] = difference
+
+        if reserved:
+            Product.objects.filter(pk__in=reserved).update(stock=Case(
+                *[When(pk=product_id, then=F('stock') - difference) for product_id, difference in reserved.items()],
+                output_field=PositiveIntegerField(),
+            ), updated_at=now)
+            in_stock, crossed = defaultdict(int), False
+            for product_id, difference in reserved.items():
+                stock = available[product_id]
+                change = int(stock - difference > 0) - int(stock > 0)
+                in_stock[categories[product_id]] += change
+                crossed = crossed or bool(change)
+            if crossed:
+                _stock_changed()
+            stats.adjust_in_stock(in_stock)
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity', 'reserved_at', 'reserved'])
+        if to_delete:
+            CartItem.objects.filter(pk__in=to_delete).delete()
+        if to_create or to_update:
+            # bulk writes don't send the signal that drops the summary
+            transaction.on_commit(lambda: invalidate_cart_summary(cart.user_id))
+
+    return results
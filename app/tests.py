@@ -1,3 +1,1139 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save
+from django.db.transaction import TransactionManagementError
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from drf_spectacular.drainage import GENERATOR_STATS
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app import metrics, stock, views
+from app.management.commands import benchmark_connections
+from app.authentication import CachedJWTAuthentication
+from app.middleware import PrimaryStickinessMiddleware, RequestMetricsMiddleware
+from app.catalog_io import ImageDataset, ProductDataset
+from app.cache import MODIFIED_KEY, PRODUCT_LIKES_NAMESPACE, VERSION_KEY, bump_namespace, get_versions
+from app.cache_backends import _MISSING, TieredCache, request_cache_counts
+from app.models import Category, CategoryStats, Product, CartItem, Comment, CustomUser, Favorite, Image, Like
+from app.registry import category_registry
+from app.routers import is_pinned, pin_to_primary, replica_reads
+from app.serializers import FastProductListSerializer, ProductSerializer
+
+# Keeps cached responses from leaking between tests (and from the dev cache)
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-shared'},
+    'principals': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-principals'},
+}
+
+
+def create_product(**kwargs):
+    category, _ = Category.objects.get_or_create(name='Phones', defaults={'image': 'category/images/1.jpg'})
+    fields = {
+        'category': category,
+        'name': 'Phone',
+        'description': '',
+        'price': 100,
+        'stock': 10,
+        'brand': 'Brand',
+        'model': 'Model',
+    }
+    fields.update(kwargs)
+    return Product.objects.create(**fields)
+
+
+def api_schema():
+    # Without the warnings about views that are unrelated to the tests
+    with GENERATOR_STATS.silence():
+        return SchemaGenerator().get_schema(request=None, public=True)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.cart = self.user.cart.get()
+        self.product = create_product(stock=5)
+
+    def test_cart_item_lifecycle_moves_stock(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+        item.quantity = 1
+        item.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+
+        item.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_reserving_more_than_stock_fails(self):
+        with self.assertRaises(stock.InsufficientStock):
+            CartItem.objects.create(cart=self.cart, product=self.product, quantity=6)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_adding_a_product_twice_answers_400_and_keeps_the_stock(self):
+        self.client.force_login(self.user)
+        first = self.client.post('/cart-item/', {'product_id': self.product.pk, 'quantity': 2})
+        self.assertEqual(first.status_code, 201)
+
+        second = self.client.post('/cart-item/', {'product_id': self.product.pk, 'quantity': 1})
+
+        self.assertEqual(second.status_code, 400)
+        self.assertIn('product_id', second.json())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_release_expired(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        self.assertEqual(stock.release_expired(ttl=timedelta(hours=1)), 0)
+        CartItem.objects.filter(pk=item.pk).update(reserved_at=item.reserved_at - timedelta(hours=2))
+
+        self.assertEqual(stock.release_expired(ttl=timedelta(hours=1)), 1)
+        self.assertEqual(stock.release_expired(ttl=timedelta(hours=1)), 0)
+        # The line stays in the cart, without its stock
+        item.refresh_from_db()
+        self.assertFalse(item.reserved)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+        # Deleting a stale copy of it must not give the stock back twice
+        stale = CartItem.objects.get(pk=item.pk)
+        stale.reserved = True
+        stale.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_released_items_reserve_again_when_changed(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        CartItem.objects.filter(pk=item.pk).update(reserved_at=item.reserved_at - timedelta(hours=2))
+        stock.release_expired(ttl=timedelta(hours=1))
+        stats = CategoryStats.objects.get(category=self.product.category)
+
+        item.quantity = 3
+        item.save()
+        item.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((item.reserved, self.product.stock), (True, 2))
+
+        CartItem.objects.filter(pk=item.pk).update(reserved_at=item.reserved_at - timedelta(hours=2))
+        stock.release_expired(ttl=timedelta(hours=1))
+        stock.apply_cart_lines(self.cart, [(self.product.pk, 5)])
+        item.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((item.reserved, self.product.stock), (True, 0))
+        stats.refresh_from_db()
+        self.assertEqual(stats.in_stock_count, 0)
+
+    def test_apply_cart_lines(self):
+        other = create_product(stock=1)
+        CartItem.objects.create(cart=self.cart, product=other, quantity=1)
+
+        results = stock.apply_cart_lines(self.cart, [(self.product.pk, 4), (other.pk, 0), (0, 1)])
+
+        self.assertEqual([result['status'] for result in results], ['created', 'removed', 'error'])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 1)
+        self.assertEqual(Product.objects.get(pk=other.pk).stock, 1)
+        self.assertEqual(list(self.cart.items.values_list('product_id', 'quantity')), [(self.product.pk, 4)])
+
+        results = stock.apply_cart_lines(self.cart, [(self.product.pk, 6)])
+        self.assertEqual(results[0]['status'], 'error')
+        self.assertEqual(self.cart.items.get().quantity, 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CategoryStatsTests(TransactionTestCase):
+    def test_stats_follow_product_like_and_stock_writes(self):
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        product = create_product(price=100, stock=1)
+        create_product(price=300, stock=0)
+        Like.objects.create(user=user, product=product)
+        CartItem.objects.create(cart=user.cart.get(), product=product, quantity=1)
+
+        stats = CategoryStats.objects.get(category=product.category)
+        self.assertEqual(
+            (stats.product_count, stats.in_stock_count, stats.min_price, stats.max_price, stats.total_likes),
+            (2, 0, 100, 300, 1),
+        )
+
+        product.save()
+        stats.refresh_from_db()
+        self.assertEqual(stats.total_likes, 1)
+
+    def test_stats_follow_cart_lines_price_and_category_changes(self):
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        cheap = create_product(price=100, stock=2)
+        dear = create_product(price=300, stock=1)
+        Like.objects.create(user=user, product=dear)
+
+        stock.apply_cart_lines(user.cart.get(), [(cheap.pk, 1), (dear.pk, 1)])
+        stats = CategoryStats.objects.get(category=cheap.category)
+        self.assertEqual(stats.in_stock_count, 1)
+        stock.apply_cart_lines(user.cart.get(), [(cheap.pk, 2)])
+        stats.refresh_from_db()
+        self.assertEqual(stats.in_stock_count, 0)
+
+        dear.refresh_from_db()
+        dear.price = 200
+        dear.stock = 5
+        dear.save()
+        stats.refresh_from_db()
+        self.assertEqual((stats.in_stock_count, stats.min_price, stats.max_price), (1, 100, 200))
+
+        tablets = Category.objects.create(name='Tablets', image='category/images/2.jpg')
+        dear.category = tablets
+        dear.save()
+        stats.refresh_from_db()
+        moved = CategoryStats.objects.get(category=tablets)
+        self.assertEqual(
+            (stats.product_count, stats.in_stock_count, stats.max_price, stats.total_likes),
+            (1, 0, 100, 0),
+        )
+        self.assertEqual(
+            (moved.product_count, moved.in_stock_count, moved.min_price, moved.total_likes),
+            (1, 1, 200, 1),
+        )
+
+        dear.delete()
+        moved.refresh_from_db()
+        self.assertEqual((moved.product_count, moved.min_price, moved.total_likes), (0, None, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LikeCountTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.product = create_product()
+
+    def counts(self):
+        self.product.refresh_from_db()
+        return self.product.like_count, CategoryStats.objects.get(category=self.product.category).total_likes
+
+    def test_likes_are_counted_on_create_and_delete(self):
+        other = CustomUser.objects.create_user(username='other', password='secret')
+        like = Like.objects.create(user=self.user, product=self.product)
+        Like.objects.create(user=other, product=self.product)
+        self.assertEqual(self.counts(), (2, 2))
+
+        like.delete()
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_rebuild_fixes_counts_and_drops_cached_pages(self):
+        Like.objects.create(user=self.user, product=self.product)
+        # Drifted by writes that skip the signals
+        Product.objects.filter(pk=self.product.pk).update(like_count=7)
+        CategoryStats.objects.update(total_likes=7)
+        versions = get_versions(['product', 'category', 'like'])
+
+        call_command('rebuild_like_counts', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(self.counts(), (1, 1))
+        for before, after in zip(versions, get_versions(['product', 'category', 'like'])):
+            self.assertNotEqual(before, after)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartItemTransactionTests(TransactionTestCase):
+    def test_failed_insert_outside_a_transaction_gives_the_stock_back(self):
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        product = create_product(stock=5)
+        CartItem.objects.create(cart=user.cart.get(), product=product, quantity=2)
+
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.create(cart=user.cart.get(), product=product, quantity=1)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 3)
+
+    def test_reservation_signal_needs_a_transaction(self):
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        item = CartItem(cart=user.cart.get(), product=create_product(stock=5), quantity=1)
+        with self.assertRaises(TransactionManagementError):
+            pre_save.send(sender=CartItem, instance=item, raw=False, using='default', update_fields=None)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConcurrentStockReservationTests(TransactionTestCase):
+    threads = 20
+    attempts_per_thread = 5
+
+    def test_no_lost_updates_under_contention(self):
+        product = create_product(stock=37)
+        successes = []
+        failures = []
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.attempts_per_thread):
+                    try:
+                        stock.reserve(product.pk, 1)
+                        successes.append(1)
+                    except stock.InsufficientStock:
+                        failures.append(1)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(successes), 37)
+        self.assertEqual(len(failures), self.threads * self.attempts_per_thread - 37)
+        self.assertEqual(product.stock, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+
+    def test_search_matches_every_term_and_ranks_name_matches_first(self):
+        description_match = create_product(name='Phone', brand='Apple', description='Works with Galaxy watches')
+        name_match = create_product(name='Galaxy S24', brand='Samsung')
+        create_product(name='Redmi', brand='Xiaomi')
+
+        response = self.client.get('/product/search/', {'q': 'galaxy'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [name_match.pk, description_match.pk])
+        self.assertEqual(self.client.get('/product/search/', {'q': 'galaxy samsung'}).json()['total'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+
+    def test_facets_follow_the_current_filter(self):
+        create_product(brand='Apple', price=100, stock=1)
+        create_product(brand='Apple', price=200, stock=0)
+        create_product(brand='Samsung', price=300, stock=3)
+
+        facets = self.client.get('/product/facets/', {'in_stock': 'true', 'max_price': 250}).json()
+
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(facets['brands'], [{'brand': 'Apple', 'count': 1}])
+        self.assertEqual(facets['categories'][0]['count'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FastProductListSerializerTests(TestCase):
+    def setUp(self):
+        category_registry.clear()
+
+    def test_output_matches_product_serializer(self):
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        liked = create_product(price='1234.5', description='Liked')
+        Like.objects.create(user=user, product=liked)
+        with_image = create_product(name='With image', price=10)
+        Image.objects.create(product=with_image, image='product/images/front.jpg')
+        create_product(name='Other category', category=Category.objects.create(name='TVs', image=''))
+
+        products = Product.objects.select_related('category', 'primary_image').order_by('pk')
+        rows = products.values(*FastProductListSerializer.value_fields)
+        for current_user in (user, AnonymousUser()):
+            request = Request(APIRequestFactory().get('/product/'))
+            request.user = current_user
+            context = {'request': request, 'liked_product_ids': {liked.pk}}
+
+            expected = JSONRenderer().render(ProductSerializer(products, many=True, context=context).data)
+            fast = JSONRenderer().render(FastProductListSerializer(rows, context).data)
+
+            self.assertEqual(fast, expected)
+            self.assertEqual(json.loads(fast)[0]['is_liked'], current_user.is_authenticated)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LikedProductIdsTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.others = [CustomUser.objects.create_user(username=f'other{i}', password='secret') for i in range(3)]
+        self.client.force_login(self.user)
+
+    def add_products(self, count, liked):
+        for index in range(count):
+            product = create_product(model=f'M{Product.objects.count()}')
+            for other in self.others:
+                Like.objects.create(user=other, product=product)
+            if index in liked:
+                Like.objects.create(user=self.user, product=product)
+            Favorite.objects.create(user=self.user, product=product)
+
+    def get(self, path):
+        caches['default'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len(queries)
+
+    def test_is_liked_costs_one_query_per_page(self):
+        self.add_products(2, liked={0})
+        counts = {path: self.get(path)[1] for path in ('/product/', '/liked/', '/favorite/')}
+
+        self.add_products(4, liked={1, 3})
+        products, count = self.get('/product/')
+        self.assertEqual(count, counts['/product/'])
+        self.assertEqual(
+            {product['model']: product['is_liked'] for product in products},
+            {'M0': True, 'M1': False, 'M2': False, 'M3': True, 'M4': False, 'M5': True},
+        )
+        for path in ('/liked/', '/favorite/'):
+            results, count = self.get(path)
+            self.assertEqual(count, counts[path])
+            self.assertEqual(sum(result['product']['is_liked'] for result in results), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CommentQueriesTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.other = CustomUser.objects.create_user(username='other', password='secret')
+        self.product = create_product()
+        self.likes = [Like.objects.create(user=user, product=self.product) for user in (self.user, self.other)]
+        self.client.force_login(self.user)
+
+    def add_comments(self, count):
+        for index in range(count):
+            comment = Comment.objects.create(user=self.other, product=self.product, comment=f'#{index}')
+            # Every other comment is liked by both users, the rest by the other one
+            comment.likes.set(self.likes if index % 2 == 0 else self.likes[1:])
+
+    def fetch(self, method, path):
+        caches['default'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        return (results['results'] if isinstance(results, dict) else results), len(queries)
+
+    def test_comment_pages_cost_the_same_whatever_their_size(self):
+        requests = [('get', '/comment/'), ('post', f'/comment/by_product/?product_id={self.product.pk}')]
+        self.add_comments(2)
+        counts = [self.fetch(method, path)[1] for method, path in requests]
+
+        self.add_comments(6)
+        for (method, path), count in zip(requests, counts):
+            comments, queries = self.fetch(method, path)
+            self.assertEqual(queries, count)
+            self.assertEqual(len(comments), 8)
+            self.assertEqual(
+                sorted((comment['like_count'], comment['is_liked']) for comment in comments),
+                [(1, False)] * 4 + [(2, True)] * 4,
+            )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PrimaryImageTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.product = create_product()
+        self.first = Image.objects.create(product=self.product, image='product/images/first.jpg', order=0)
+        self.second = Image.objects.create(product=self.product, image='product/images/second.jpg', order=1)
+
+    def primary_image(self, product):
+        return Product.objects.values_list('primary_image', flat=True).get(pk=product.pk)
+
+    def test_primary_image_follows_reorders_moves_and_deletes(self):
+        self.assertEqual(self.primary_image(self.product), self.first.pk)
+        stale = Product.objects.get(pk=self.product.pk)
+
+        self.first.order = 2
+        self.first.save()
+        self.assertEqual(self.primary_image(self.product), self.second.pk)
+        # A full save of a copy loaded before the reorder keeps the new pointer
+        stale.save()
+        self.assertEqual(self.primary_image(self.product), self.second.pk)
+        self.assertTrue(self.client.get(f'/product/{self.product.pk}/').json()['primary_image'].endswith('second.jpg'))
+
+        self.second.delete()
+        self.assertEqual(self.primary_image(self.product), self.first.pk)
+
+        other = create_product(model='Other')
+        self.first.product = other
+        self.first.save()
+        self.assertIsNone(self.primary_image(self.product))
+        self.assertEqual(self.primary_image(other), self.first.pk)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.cart = self.user.cart.get()
+        self.product = create_product(price=100, stock=10)
+        self.client.force_login(self.user)
+
+    def summary(self):
+        return self.client.get('/cart/summary/').json()
+
+    def test_summary_is_cached_until_an_item_changes(self):
+        self.assertEqual(self.summary(), {'count': 0, 'subtotal': 0})
+        # Left cached by a write that skips the signals
+        CartItem.objects.bulk_create([CartItem(cart=self.cart, product=self.product, quantity=1)])
+        self.assertEqual(self.summary()['count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item = CartItem.objects.create(cart=self.cart, product=create_product(price=50, model='Cheap'), quantity=2)
+        self.assertEqual(self.summary(), {'count': 3, 'subtotal': 200})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.quantity = 1
+            item.save()
+        self.assertEqual(self.summary(), {'count': 2, 'subtotal': 150})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.apply_cart_lines(self.cart, [(self.product.pk, 3)])
+        self.assertEqual(self.summary(), {'count': 4, 'subtotal': 350})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(self.summary(), {'count': 3, 'subtotal': 300})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.product_ids = [create_product(model=f'M{i}').pk for i in range(5)]
+
+    def test_next_and_previous_walk_every_product_once(self):
+        page = self.client.get('/product/', {'pagination': 'cursor', 'page_size': 2}).json()
+        self.assertNotIn('total', page)
+        self.assertIsNone(page['previous'])
+        pages = [page]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+
+        self.assertEqual(
+            [[product['id'] for product in page['results']] for page in pages],
+            [self.product_ids[4:2:-1], self.product_ids[2:0:-1], self.product_ids[:1]],
+        )
+        previous = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+
+    def test_total_only_when_asked(self):
+        page = self.client.get('/product/', {'pagination': 'cursor', 'page_size': 2, 'count': 'true'}).json()
+        self.assertEqual(page['total'], 5)
+        # Without a cursor or the mode, lists stay page-number paginated
+        self.assertEqual(self.client.get('/product/', {'page_size': 2}).json()['page'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CATEGORY_REGISTRY_CHECK_INTERVAL=60)
+class CategoryRegistryTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        category_registry.clear()
+
+    def serialize(self, product):
+        request = Request(APIRequestFactory().get('/product/'))
+        return ProductSerializer(product, context={'request': request}).data['category']
+
+    def test_edits_show_up_after_the_version_check(self):
+        product = create_product()
+        self.assertEqual(self.serialize(product)['name'], 'Phones')
+
+        # Another worker renames the category and bumps the shared version
+        Category.objects.filter(pk=product.category_id).update(name='Smartphones')
+        bump_namespace('category')
+        product = Product.objects.select_related('category').get(pk=product.pk)
+        self.assertEqual(self.serialize(product)['name'], 'Phones')
+
+        with override_settings(CATEGORY_REGISTRY_CHECK_INTERVAL=0):
+            self.assertEqual(self.serialize(product)['name'], 'Smartphones')
+
+    @override_settings(CATEGORY_REGISTRY_MAX_ENTRIES=2)
+    def test_entries_are_bounded_across_hosts(self):
+        product = create_product()
+        for host in ('a.example', 'b.example', 'c.example'):
+            request = Request(APIRequestFactory().get('/product/', HTTP_HOST=host))
+            data = ProductSerializer(product, context={'request': request}).data['category']
+            self.assertTrue(data['image'].startswith(f'http://{host}/'))
+        self.assertEqual(
+            [base_url for base_url, category_id in category_registry.entries],
+            ['http://b.example/', 'http://c.example/'],
+        )
+
+    def test_schema_describes_the_embedded_category(self):
+        schema = api_schema()
+        category = schema['components']['schemas']['Product']['properties']['category']
+        self.assertEqual(category['allOf'], [{'$ref': '#/components/schemas/Category'}])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+
+    def test_unchanged_pages_answer_304(self):
+        product = create_product()
+        for url in ('/product/', f'/product/{product.pk}/', '/category/', f'/category/{product.category_id}/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+            # Neither the cached page nor the 304 touch the database
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 200)
+                not_modified = self.client.get(url, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(not_modified.status_code, 304)
+            since = self.client.get(url, headers={'If-Modified-Since': response['Last-Modified']})
+            self.assertEqual(since.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        product = create_product()
+        etag = self.client.get(f'/product/{product.pk}/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 200
+            product.save()
+
+        response = self.client.get(f'/product/{product.pk}/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TieredCacheTests(TestCase):
+    def tiered_cache(self, **options):
+        cache = TieredCache(f'tests-tiered-{self._testMethodName}', {'OPTIONS': {'SHARED_ALIAS': 'shared', **options}})
+        cache.clear()
+        return cache
+
+    def test_memory_tier_is_bounded_by_entries_and_bytes(self):
+        cache = self.tiered_cache(LOCAL_MAX_ENTRIES=2, LOCAL_MAX_BYTES=1024)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        cache.set('large', 'x' * 2048)
+
+        self.assertEqual(list(cache._local.entries), [cache.make_key('a'), cache.make_key('c')])
+        self.assertEqual(cache.stats()['evictions'], 1)
+        # Evicted or too large for memory, still served from the shared tier
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.get('large'), 'x' * 2048)
+
+    def test_memory_copies_never_outlive_the_shared_entry(self):
+        cache = self.tiered_cache(LOCAL_TIMEOUT=300)
+        cache.set('page', 'body', 60)
+        cache._local.clear()
+        self.assertEqual(cache.get('page'), 'body')
+
+        expires_at = cache._local.entries[cache.make_key('page')][0]
+        self.assertLessEqual(expires_at, time.time() + 60)
+        with mock.patch('app.cache_backends.time.time', return_value=time.time() + 61):
+            self.assertIs(cache._local.get(cache.make_key('page')), _MISSING)
+
+    def test_lookups_are_counted_for_the_request(self):
+        cache = self.tiered_cache()
+        counts = {'hits': 0, 'misses': 0}
+        token = request_cache_counts.set(counts)
+        try:
+            cache.get('missing')
+            cache.set('key', 'value')
+            cache.get('key')
+            cache._local.clear()
+            cache.get('key')
+        finally:
+            request_cache_counts.reset(token)
+
+        self.assertEqual(counts, {'hits': 2, 'misses': 1})
+        self.assertEqual(cache.stats()['shared_hits'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VersionedCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+
+    def test_version_keys_never_expire(self):
+        # The production shared tier, whose incr() would re-set with its default timeout
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+        with override_settings(CACHES={**LOCMEM_CACHES, 'shared': file_cache}):
+            shared = caches['shared']
+            before = get_versions(['product'])
+            bump_namespace('product')
+            bump_namespace('product')
+
+            self.assertNotEqual(get_versions(['product']), before)
+            with open(shared._key_to_file(VERSION_KEY.format('product')), 'rb') as file:
+                self.assertIsNone(pickle.load(file))
+
+    def test_only_visible_changes_drop_the_catalog_pages(self):
+        product = create_product(stock=2)
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        cart = user.cart.get()
+        versions = get_versions(['product', 'like'])
+        listing = self.client.get('/product/')
+        detail = self.client.get(f'/product/{product.pk}/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item = CartItem.objects.create(cart=cart, product=product, quantity=1)
+            Like.objects.create(user=user, product=product)
+        self.assertEqual(get_versions(['product', 'like']), versions)
+        self.assertEqual(self.client.get('/product/')['ETag'], listing['ETag'])
+        # The liked product's own page shows the new count
+        response = self.client.get(f'/product/{product.pk}/')
+        self.assertNotEqual(response['ETag'], detail['ETag'])
+        self.assertEqual(response.json()['like_count'], 1)
+
+        # Selling out or coming back takes it in or out of in_stock lists
+        with self.captureOnCommitCallbacks(execute=True):
+            item.quantity = 2
+            item.save()
+        self.assertNotEqual(get_versions(['product']), versions[:1])
+        versions = get_versions(['product'])
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertNotEqual(get_versions(['product']), versions)
+
+    def test_pages_are_not_shared_between_jwt_users(self):
+        product = create_product()
+        liker = CustomUser.objects.create_user(username='liker', password='secret')
+        other = CustomUser.objects.create_user(username='other', password='secret')
+        Like.objects.create(user=liker, product=product)
+
+        for user, liked in ((other, False), (liker, True), (other, False)):
+            headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+            for url in ('/product/', '/liked/'):
+                response = self.client.get(url, headers=headers)
+                self.assertEqual(response.status_code, 200)
+                if url == '/product/':
+                    self.assertEqual(response.json()['results'][0]['is_liked'], liked)
+                else:
+                    self.assertEqual(len(response.json()['results']), int(liked))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogImportTests(TestCase):
+    def test_products_upsert_on_brand_and_model(self):
+        existing = create_product(brand='Acme', model='A1', name='Old name')
+        dataset = ProductDataset()
+        rows = [
+            {'brand': 'Acme', 'model': 'A1', 'category': 'phones', 'name': 'New name', 'price': '5', 'stock': 2},
+            {'brand': 'Acme', 'model': 'A2', 'category': 'phones', 'name': 'Second', 'price': '7.5', 'stock': '0'},
+            {'brand': 'Acme', 'model': 'A3', 'category': 'missing', 'name': 'Lost', 'price': '1', 'stock': 1},
+            {'brand': 'Acme', 'model': 'A4', 'category': 'phones', 'name': 'Bad', 'price': 'x', 'stock': 1},
+        ]
+
+        created, updated, errors = dataset.import_batch(rows)
+        dataset.finish()
+
+        self.assertEqual((created, updated, [index for index, _ in errors]), (1, 1, [2, 3]))
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.stock), ('New name', 2))
+        self.assertIn('Second', Product.objects.get(model='A2').search_document)
+        self.assertEqual(CategoryStats.objects.get(category=existing.category).product_count, 2)
+
+    def test_only_the_oldest_duplicate_is_updated(self):
+        oldest = create_product(brand='Acme', model='A1', name='Oldest')
+        newer = create_product(brand='Acme', model='A1', name='Newer')
+        dataset = ProductDataset()
+
+        created, updated, errors = dataset.import_batch([
+            {'brand': 'Acme', 'model': 'A1', 'category': 'phones', 'name': 'Imported', 'price': '5', 'stock': 2},
+        ])
+
+        self.assertEqual((created, updated, errors), (0, 1, []))
+        self.assertEqual(Product.objects.get(pk=oldest.pk).name, 'Imported')
+        self.assertEqual(Product.objects.get(pk=newer.pk).name, 'Newer')
+
+    def test_images_refresh_the_primary_image(self):
+        product = create_product(brand='Acme', model='A1')
+        dataset = ImageDataset()
+        dataset.import_batch([
+            {'brand': 'Acme', 'model': 'A1', 'image': 'product/images/back.jpg', 'order': '1'},
+            {'brand': 'Acme', 'model': 'A1', 'image': 'product/images/front.jpg', 'order': '0'},
+        ])
+
+        product.refresh_from_db()
+        self.assertEqual(product.primary_image.image.name, 'product/images/front.jpg')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PRODUCT_EXPORT_CHUNK_SIZE=2)
+class ProductExportTests(TestCase):
+    def test_streams_every_product_as_ndjson(self):
+        user = CustomUser.objects.create_user(username='partner', password='secret')
+        products = [create_product(name=f'Phone {i}') for i in range(5)]
+        Like.objects.create(user=user, product=products[3])
+
+        self.assertEqual(self.client.get('/product/export/').status_code, 403)
+
+        self.client.force_login(user)
+        response = self.client.get('/product/export/')
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['id'] for line in lines], [product.pk for product in products])
+        self.assertEqual([line['is_liked'] for line in lines], [False, False, False, True, False])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SeedAndBenchmarkTests(TestCase):
+    def test_benchmark_replays_the_mix_over_seeded_data(self):
+        call_command(
+            'seed_data', users=3, categories=2, products=20, images_per_product=2, likes=10, comments=10,
+            cart_items=3, seed=1, stdout=StringIO(),
+        )
+        self.assertEqual(Product.objects.filter(primary_image__isnull=True).count(), 0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            # Too few products for the deeper pages
+            call_command('benchmark', requests=60, mix='product-list-page=0', output=output, stdout=StringIO())
+            with open(output) as file:
+                results = json.load(file)
+
+        self.assertEqual(results['requests'], 60)
+        for name, route in results['routes'].items():
+            self.assertEqual(route['errors'], 0, name)
+            self.assertIsNotNone(route['queries_per_request'])
+
+    def test_connection_benchmark_waits_for_a_successful_answer(self):
+        command = benchmark_connections.Command()
+        server = mock.Mock(**{'poll.return_value': None})
+        failure = urllib.error.HTTPError('http://server/category/', 500, 'Server Error', {}, None)
+        with mock.patch('urllib.request.urlopen', side_effect=failure):
+            with self.assertRaisesMessage(CommandError, 'last answer 500'):
+                command.wait_for('http://server', server, timeout=.1)
+        with mock.patch('urllib.request.urlopen', side_effect=[OSError, mock.MagicMock()]):
+            command.wait_for('http://server', server, timeout=5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, QUERY_BUDGETS={'category-list': 0}, SERVER_TIMING_HEADER=True)
+class RequestMetricsMiddlewareTests(TestCase):
+    def test_server_timing_and_query_budget(self):
+        create_product()
+
+        with self.assertLogs('app.requests', 'INFO') as logs:
+            response = self.client.get('/category/')
+            self.client.get('/product/')
+
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries", cache;desc=')
+        over, within = logs.records
+        self.assertEqual(over.levelname, 'WARNING')
+        self.assertEqual(json.loads(over.getMessage())['route'], 'category-list')
+        self.assertTrue(json.loads(over.getMessage())['over_budget'])
+        # Every request is logged at the default level
+        self.assertEqual(within.levelname, 'INFO')
+        self.assertFalse(json.loads(within.getMessage())['over_budget'])
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_timings_stay_private_by_default(self):
+        self.assertFalse(self.client.get('/category/').has_header('Server-Timing'))
+
+    async def test_async_requests_stay_async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware in (RequestMetricsMiddleware, PrimaryStickinessMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(get_response)))
+        response = await self.async_client.get('/async/product/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries"')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_TOKEN='')
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(METRICS_DIR=directory.name))
+        metrics._registry = None
+        # Later requests would flush to the removed directory otherwise
+        self.addCleanup(setattr, metrics, '_registry', None)
+
+    def test_metrics_cover_views_cache_and_auth_failures(self):
+        create_product()
+        self.client.get('/product/')
+        self.client.get('/product/')
+        self.client.get('/cart/')
+
+        # Another worker's flushed values are added in
+        other = metrics.Registry()
+        other.inc('auth_failures_total', {'view': 'CartViewSet', 'status': '403'})
+        other.flush()
+
+        with override_settings(METRICS_TOKEN='secret'):
+            body = self.client.get('/metrics/', headers={'Authorization': 'Bearer secret'}).content.decode()
+
+        self.assertIn('http_request_duration_seconds_count{action="list",view="ProductViewSet"} 2', body)
+        self.assertIn('response_cache_requests_total{result="hit",viewset="ProductViewSet"} 1', body)
+        self.assertIn('response_cache_requests_total{result="miss",viewset="ProductViewSet"} 1', body)
+        self.assertIn('auth_failures_total{status="403",view="CartViewSet"} 2', body)
+        self.assertIn('db_queries_per_request_bucket{action="list",view="ProductViewSet",le="+Inf"} 2', body)
+
+    def test_new_database_connections_are_counted(self):
+        connection_created.send(sender=connection.__class__, connection=connection)
+
+        body = metrics.render(metrics.collect())
+
+        self.assertIn('db_connections_total{database="default"} 1', body)
+        self.assertIn('# TYPE db_pool_connections_in_use histogram', body)
+
+    def test_pool_statistics_are_recorded(self):
+        stats = {'requests_num': 3, 'requests_wait_ms': 250, 'requests_errors': 1, 'pool_size': 4, 'pool_available': 1}
+        pooled = mock.Mock(alias='default', settings_dict={'OPTIONS': {'pool': {'max_size': 4}}})
+        pooled.pool.pop_stats.return_value = stats
+        unpooled = mock.Mock(alias='other', settings_dict={'OPTIONS': {}})
+        registry = metrics.Registry()
+
+        with mock.patch.object(metrics.connections, 'all', return_value=[pooled, unpooled]):
+            metrics.record_database_pools(registry)
+
+        unpooled.pool.pop_stats.assert_not_called()
+        self.assertEqual(registry.values['db_pool_requests_total'], {'[["database", "default"]]': 3})
+        self.assertEqual(registry.values['db_pool_wait_seconds_total'], {'[["database", "default"]]': .25})
+        self.assertEqual(registry.values['db_pool_timeouts_total'], {'[["database", "default"]]': 1})
+        in_use = registry.values['db_pool_connections_in_use']['[["database", "default"]]']
+        self.assertEqual((in_use['count'], in_use['sum']), (1, 3))
+
+    def test_endpoint_needs_the_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+        staff = CustomUser.objects.create_user(username='staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 401)
+            self.assertEqual(
+                self.client.get('/metrics/', headers={'Authorization': 'Bearer secret'}).status_code, 200,
+            )
+
+    def test_files_of_exited_processes_are_retired(self):
+        for pid in (1001, 1002):
+            exited = metrics.Registry()
+            exited.path = os.path.join(settings.METRICS_DIR, f'{metrics.HOST}-{pid}-0000abcd.json')
+            exited.inc('auth_failures_total', {'view': 'CartViewSet', 'status': '403'})
+            exited.observe('db_queries_per_request', {'view': 'CartViewSet', 'action': 'list'}, 3)
+            exited.flush()
+        # Another host's processes can't be checked from here
+        elsewhere = metrics.Registry()
+        elsewhere.path = os.path.join(settings.METRICS_DIR, 'elsewhere-1003-0000abcd.json')
+        elsewhere.inc('auth_failures_total', {'view': 'CartViewSet', 'status': '403'})
+        elsewhere.flush()
+
+        with mock.patch.object(metrics, '_is_running', lambda pid: pid == os.getpid()):
+            for _ in range(2):
+                body = metrics.render(metrics.collect())
+                self.assertIn('auth_failures_total{status="403",view="CartViewSet"} 3', body)
+                self.assertIn('db_queries_per_request_count{action="list",view="CartViewSet"} 2', body)
+
+        self.assertEqual(
+            sorted(filename for filename in os.listdir(settings.METRICS_DIR) if filename.endswith('.json')),
+            sorted([
+                os.path.basename(metrics.registry().path), 'elsewhere-1003-0000abcd.json',
+                f'{metrics.HOST}-retired.json',
+            ]),
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASES=['replica'])
+class ReplicaRouterTests(TestCase):
+    def test_reads_use_the_replica_only_when_asked(self):
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_writers_are_pinned_to_the_primary(self):
+        caches['shared'].clear()
+        self.assertFalse(is_pinned('user:1'))
+        pin_to_primary('user:1')
+        self.assertTrue(is_pinned('user:1'))
+        self.assertFalse(is_pinned(None))
+
+
+@unittest.skipUnless('replica' in settings.DATABASES, "needs the replica alias of the test settings")
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASES=['replica'])
+class ReplicaReadsTests(TransactionTestCase):
+    # `replica` mirrors the primary's test database: the queries it runs tell
+    # where a page was read from
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.product = create_product()
+        self.user = CustomUser.objects.create_user(username='buyer', password='password')
+
+    def settle(self):
+        # As if the last catalog change was long enough ago to be replicated
+        caches['default'].clear()
+        namespaces = [*views.PRODUCT_CACHE_NAMESPACES, PRODUCT_LIKES_NAMESPACE.format(self.product.pk)]
+        caches['shared'].set_many({MODIFIED_KEY.format(ns): time.time() - 60 for ns in namespaces})
+
+    def read_from(self, client):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = client.get(f'/product/{self.product.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.last_page_cache = getattr(response.wsgi_request, 'response_cache', None)
+        return 'replica' if replica.captured_queries else 'default'
+
+    def test_only_the_writer_is_kept_on_the_primary(self):
+        self.settle()
+        self.assertEqual(self.read_from(self.client), 'replica')
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.read_from(self.client), 'replica')
+        self.assertEqual(self.client.post(f'/product/{self.product.pk}/like/').status_code, 201)
+        self.settle()
+        self.assertEqual(self.read_from(self.client), 'default')
+        self.assertEqual(self.read_from(self.client_class()), 'replica')
+
+    def test_pages_read_just_after_a_change_are_not_cached(self):
+        self.settle()
+        bump_namespace('product')
+        anonymous = self.client_class()
+        for _ in range(2):
+            self.assertEqual(self.read_from(anonymous), 'replica')
+            self.assertIsNone(self.last_page_cache)
+
+        self.settle()
+        for expected in ('miss', 'hit'):
+            self.read_from(anonymous)
+            self.assertEqual(self.last_page_cache, expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        caches['principals'].clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret', name='Buyer')
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_cached_principal_costs_no_queries(self):
+        self.assertEqual(self.client.get('/auth/me/', headers=self.headers).json()['name'], 'Buyer')
+        with self.assertNumQueries(0):
+            response = self.client.get('/auth/me/', headers=self.headers)
+        self.assertEqual(response.json()['username'], 'buyer')
+
+    def test_updates_password_changes_and_deactivation_drop_the_principal(self):
+        self.client.get('/auth/me/', headers=self.headers)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                '/auth/update/', {'name': 'Renamed'}, content_type='application/json', headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/auth/me/', headers=self.headers).json()['name'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('changed')
+            self.user.save()
+        authentication = CachedJWTAuthentication()
+        token = AccessToken.for_user(self.user)
+        authentication.get_user(token)
+        with self.assertNumQueries(1):
+            # The password isn't cached, it's loaded when needed
+            self.assertTrue(authentication.get_user(token).check_password('changed'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/auth/me/', headers=self.headers).status_code, 403)
+
+    def test_schema_documents_the_bearer_scheme(self):
+        schema = api_schema()
+        self.assertEqual(schema['components']['securitySchemes']['jwtAuth']['scheme'], 'bearer')
+        self.assertIn({'jwtAuth': []}, schema['paths']['/product/']['get']['security'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        caches['principals'].clear()
+        self.products = [create_product(model=f'M{i}') for i in range(3)]
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        Like.objects.create(user=self.user, product=self.products[1])
+
+    async def assert_same_as_drf(self, path, headers=None):
+        drf = await sync_to_async(self.client.get)(path, headers=headers)
+        asynchronous = await self.async_client.get(f'/async{path}', headers=headers)
+        self.assertEqual(asynchronous.status_code, drf.status_code)
+        self.assertEqual(asynchronous.json(), drf.json())
+        return asynchronous.json()
+
+    async def test_async_views_answer_like_the_drf_views(self):
+        category_id = self.products[0].category_id
+        for path in ('/product/', f'/product/{self.products[0].pk}/', '/category/', f'/category/{category_id}/'):
+            await self.assert_same_as_drf(path)
+
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        page = await self.assert_same_as_drf('/product/', headers)
+        self.assertEqual([item['id'] for item in page['results']], [product.pk for product in self.products])
+        self.assertEqual([item['is_liked'] for item in page['results']], [False, True, False])
+
+        invalid = {'Authorization': 'Bearer invalid'}
+        response = await self.async_client.get('/async/product/', headers=invalid)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_cached_pages_are_kept_per_host(self):
+        forged = await sync_to_async(self.client.get)('/async/category/', headers={'Host': 'forged.example'})
+        self.assertTrue(forged.json()['results'][0]['image'].startswith('http://forged.example/'))
+        page = (await self.async_client.get('/async/category/')).json()
+        self.assertTrue(page['results'][0]['image'].startswith('http://testserver/'))
+
+    async def test_comments_by_product_matches_the_drf_action(self):
+        comment = await Comment.objects.acreate(user=self.user, product=self.products[0], comment='Nice')
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        path = f'/comment/by_product/?product_id={self.products[0].pk}'
+        for query_headers, status_code in ((None, 403), (headers, 200)):
+            drf = await sync_to_async(self.client.post)(path, headers=query_headers)
+            asynchronous = await self.async_client.post(f'/async{path}', headers=query_headers)
+            self.assertEqual((asynchronous.status_code, drf.status_code), (status_code, status_code))
+            self.assertEqual(asynchronous.json(), drf.json())
+        self.assertEqual([item['id'] for item in asynchronous.json()], [comment.pk])
+
+        for product_id in ('', 'abc'):
+            path = f'/comment/by_product/?product_id={product_id}'
+            drf = await sync_to_async(self.client.post)(path, headers=headers)
+            asynchronous = await self.async_client.post(f'/async{path}', headers=headers)
+            self.assertEqual((asynchronous.status_code, drf.status_code), (400, 400))
+        response = await self.async_client.get(f'/async/comment/by_product/?product_id={comment.product_id}')
+        self.assertEqual(response.status_code, 405)
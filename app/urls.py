@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from app import async_views
 from app.views import *
 
 router = DefaultRouter()
@@ -14,8 +15,16 @@ router.register('cart-item', CartItemViewSet, basename='cart-item'),
 
 urlpatterns = [
     path('', include(router.urls)),
+    # Async catalog reads, for deployments served through root/asgi.py
+    path('async/category/', async_views.category_list, name='async_category_list'),
+    path('async/category/<int:pk>/', async_views.category_detail, name='async_category_detail'),
+    path('async/product/', async_views.product_list, name='async_product_list'),
+    path('async/product/<int:pk>/', async_views.product_detail, name='async_product_detail'),
+    path('async/comment/by_product/', async_views.comments_by_product, name='async_comments_by_product'),
     # Users
     path('auth/register/', UserRegisterJWTView.as_view(), name='jwt_register'),
     path('auth/me/', UserMeView.as_view(), name='user_me'),
     path('auth/update/', UserUpdateView.as_view(), name='user_update'),
+    # Monitoring
+    path('metrics/', metrics_view, name='metrics'),
 ]
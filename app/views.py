@@ -1,54 +1,212 @@
-from django.db.models import Count, Prefetch
+import hmac
+import json
+from contextlib import ExitStack
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
-from rest_framework import viewsets, permissions, generics
+from rest_framework import viewsets, permissions, generics, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from app.pagination import CustomPagination
+from app.cache import versioned_cache_page, versioned_condition, metered_cache_page, get_or_set_versioned, \
+    last_modified, shared_cache, with_object_namespace, CART_SUMMARY_KEY, PRODUCT_LIKES_NAMESPACE
+from app import metrics
+from app.catalog_io import batched
+from app.filters import ProductFilter, product_facets
+from app.pagination import CustomPagination, CursorModePagination
+from app.routers import is_pinned, recently_changed, replica_reads, stickiness_key
+from app.search import search_products
+from app.stock import InsufficientStock, apply_cart_lines
 from app.serializers import *
 
 
 # Create your views here.
 
+CATEGORY_CACHE_NAMESPACES = ('category',)
+# Single likes only bump the product's PRODUCT_LIKES_NAMESPACE (its detail
+# page), lists show new like counts once they expire; 'like' is for recounts
+PRODUCT_CACHE_NAMESPACES = ('product', 'category', 'image', 'like')
+PRODUCT_FACET_CACHE_NAMESPACES = ('product', 'category')
 
-class CategoryViewSet(viewsets.ModelViewSet):
+
+def annotate_comment_likes(queryset, user):
+    if user.is_authenticated:
+        is_liked = Exists(Comment.likes.through.objects.filter(comment=OuterRef('pk'), like__user=user))
+    else:
+        is_liked = Value(False)
+    return queryset.annotate(like_count=Count('likes'), is_liked=is_liked)
+
+
+class LikedProductsMixin:
+    """
+    Looks up which of the serialized products the user has liked with one query
+    and hands the ids to ProductSerializer (also when nested) via the context.
+    """
+    product_id_field = 'pk'
+
+    def liked_product_ids(self, product_ids):
+        return set(
+            Like.objects.filter(user=self.request.user, product_id__in=product_ids)
+            .values_list('product_id', flat=True)
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        # Only on reads: a write may still change which product is serialized
+        if args and 'data' not in kwargs and self.request.user.is_authenticated:
+            instances = args[0] if kwargs.get('many') else [args[0]]
+            context = kwargs.setdefault('context', self.get_serializer_context())
+            context['liked_product_ids'] = self.liked_product_ids(
+                {getattr(instance, self.product_id_field) for instance in instances}
+            )
+        return super().get_serializer(*args, **kwargs)
+
+
+class ReplicaReadsMixin:
+    """
+    Runs the queries of safe requests on a read replica (app/routers.py),
+    unless the user or session wrote recently: the write may not have reached
+    the replica yet. Neither may a recent change of the viewset's cache
+    namespaces, so the pages read then aren't cached.
+    """
+    cache_namespaces = ()
+    cache_object_namespace = None
+
+    def dispatch(self, request, *args, **kwargs):
+        self.read_routing = ExitStack()
+        with self.read_routing:
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.reads_from_replica(request):
+            self.read_routing.enter_context(replica_reads())
+            namespaces = with_object_namespace(self.cache_namespaces, self.cache_object_namespace, self.kwargs)
+            request.skip_page_cache = recently_changed(last_modified(namespaces))
+
+    def reads_from_replica(self, request):
+        if not settings.REPLICA_DATABASES or request.method not in permissions.SAFE_METHODS:
+            return False
+        return not is_pinned(stickiness_key(request))
+
+
+class CategoryViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
+    cache_namespaces = CATEGORY_CACHE_NAMESPACES
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     pagination_class = CustomPagination
 
-    @method_decorator(cache_page(60))
+    @method_decorator(versioned_condition(CATEGORY_CACHE_NAMESPACES))
+    @method_decorator(versioned_cache_page(settings.CATALOG_CACHE_TIMEOUT, CATEGORY_CACHE_NAMESPACES))
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    @method_decorator(cache_page(60))
+    @method_decorator(versioned_condition(CATEGORY_CACHE_NAMESPACES))
+    @method_decorator(versioned_cache_page(settings.CATALOG_CACHE_TIMEOUT, CATEGORY_CACHE_NAMESPACES))
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.select_related('category') \
-        .prefetch_related('likes_product') \
-        .annotate(like_count=Count('likes_product'))
+    @action(detail=False, methods=["get"])
+    def stats(self, request):
+        category_stats = CategoryStats.objects.select_related('category').order_by('category__name')
+        page = self.paginate_queryset(category_stats)
+        serializer = CategoryStatsSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class ProductViewSet(ReplicaReadsMixin, LikedProductsMixin, viewsets.ModelViewSet):
+    cache_namespaces = PRODUCT_CACHE_NAMESPACES
+    cache_object_namespace = PRODUCT_LIKES_NAMESPACE
+    # Ordered for stable page-number pages (cursor pages use their own order)
+    queryset = Product.objects.select_related('category', 'primary_image').order_by('pk')
     serializer_class = ProductSerializer
-    pagination_class = CustomPagination
+    pagination_class = CursorModePagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
 
-    @method_decorator(cache_page(60))
+    @method_decorator(versioned_condition(PRODUCT_CACHE_NAMESPACES))
+    @method_decorator(versioned_cache_page(settings.CATALOG_CACHE_TIMEOUT, PRODUCT_CACHE_NAMESPACES))
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
-
-    @method_decorator(cache_page(60))
+        if not settings.FAST_PRODUCT_LIST:
+            return super().list(request, *args, **kwargs)
+        rows = self.filter_queryset(self.get_queryset()).values(*FastProductListSerializer.value_fields)
+        page = self.paginate_queryset(rows)
+        rows = page if page is not None else list(rows)
+        context = self.get_serializer_context()
+        if request.user.is_authenticated:
+            context['liked_product_ids'] = self.liked_product_ids([row['id'] for row in rows])
+        data = FastProductListSerializer(rows, context=context).data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    @method_decorator(versioned_condition(PRODUCT_CACHE_NAMESPACES, object_namespace=PRODUCT_LIKES_NAMESPACE))
+    @method_decorator(versioned_cache_page(
+        settings.CATALOG_CACHE_TIMEOUT, PRODUCT_CACHE_NAMESPACES, object_namespace=PRODUCT_LIKES_NAMESPACE,
+    ))
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
+    @method_decorator(versioned_cache_page(settings.CATALOG_CACHE_TIMEOUT, PRODUCT_CACHE_NAMESPACES))
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        products = search_products(self.filter_queryset(self.get_queryset()), query)
+        # Page numbers keep the rank order, cursor pages would re-sort by id
+        paginator = CustomPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def facets(self, request):
+        products = self.filter_queryset(self.get_queryset())
+        facets = get_or_set_versioned(
+            ProductFilter.cache_key(request.query_params),
+            PRODUCT_FACET_CACHE_NAMESPACES,
+            lambda: product_facets(products),
+            settings.CATALOG_CACHE_TIMEOUT,
+        )
+        return Response(facets)
+
+    @action(detail=False, methods=["get"], permission_classes=[permissions.IsAuthenticated])
+    def export(self, request):
+        """
+        Every (filtered) product as NDJSON, one object per line in the list
+        format, streamed from a server-side cursor chunk by chunk.
+        """
+        rows = self.filter_queryset(self.get_queryset()).order_by('pk') \
+            .values(*FastProductListSerializer.value_fields) \
+            .iterator(chunk_size=settings.PRODUCT_EXPORT_CHUNK_SIZE)
+        context = self.get_serializer_context()
+
+        def lines():
+            for chunk in batched(rows, settings.PRODUCT_EXPORT_CHUNK_SIZE):
+                context['liked_product_ids'] = self.liked_product_ids([row['id'] for row in chunk])
+                yield ''.join(
+                    json.dumps(product, ensure_ascii=False, separators=(',', ':')) + '\n'
+                    for product in FastProductListSerializer(chunk, context=context).data
+                )
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        # Let nginx pass chunks on as they come instead of buffering them
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
     @action(detail=True, methods=["post"], permission_classes=[permissions.IsAuthenticated])
     def like(self, request, pk=None):
         product = self.get_object()
         user = request.user
         like, created = Like.objects.get_or_create(user=user, product=product)
         if created:
-            product.likes_product.add(like)
             return Response({"liked": True}, status=status.HTTP_201_CREATED)
         return Response({"liked": True}, status=status.HTTP_200_OK)
 
@@ -62,73 +220,92 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({"liked": False}, status=status.HTTP_200_OK)
         return Response({"error": "Like not found."}, status=status.HTTP_400_BAD_REQUEST)
 
-class LikedViewSet(viewsets.ModelViewSet):
+class LikedViewSet(LikedProductsMixin, viewsets.ModelViewSet):
     serializer_class = LikeSerializer
+    product_id_field = 'product_id'
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = CursorModePagination
 
-    @method_decorator(cache_page(60))
+    @method_decorator(metered_cache_page(60))
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Like.objects.select_related('user', 'product', 'product__category') \
-            .filter(user=self.request.user) \
-            .prefetch_related(
-            Prefetch('product__likes_product', queryset=Like.objects.select_related('user'))
-        )
+        return Like.objects.select_related('user', 'product', 'product__category', 'product__primary_image') \
+            .filter(user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-@method_decorator(cache_page(60), name='list')
-@method_decorator(cache_page(60), name='retrieve')
-class FavoriteViewSet(viewsets.ModelViewSet):
+@method_decorator(metered_cache_page(60), name='list')
+@method_decorator(metered_cache_page(60), name='retrieve')
+class FavoriteViewSet(LikedProductsMixin, viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
+    product_id_field = 'product_id'
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = CursorModePagination
 
     def get_queryset(self):
         return Favorite.objects.filter(user=self.request.user) \
-            .select_related('product', 'product__category') \
-            .prefetch_related('product__likes_product')
+            .select_related('product', 'product__category', 'product__primary_image')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-@method_decorator(cache_page(60), name='list')
+@method_decorator(metered_cache_page(60), name='list')
 class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
-    pagination_class = CustomPagination
+    pagination_class = CursorModePagination
 
     def get_queryset(self):
-        return Comment.objects.select_related('user', 'product', 'product__category')
+        queryset = Comment.objects.select_related('user', 'product', 'product__category')
+        return annotate_comment_likes(queryset, self.request.user)
 
     @action(detail=False, methods=["post"], permission_classes=[permissions.IsAuthenticated])
     def by_product(self, request):
         product_id = request.query_params.get("product_id")
         if not product_id:
             return Response({"error": "product_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if not product_id.isdigit():
+            return Response({"error": "product_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
         comments = Comment.objects.filter(product_id=product_id).select_related('user', 'product')
-        serializer = CommentSerializer(comments, many=True)
+        serializer = CommentSerializer(annotate_comment_likes(comments, request.user), many=True,
+                                       context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-@method_decorator(cache_page(60), name='list')
+@method_decorator(metered_cache_page(60), name='list')
 class CartViewSet(viewsets.ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = CustomPagination
 
     def get_queryset(self):
+        items = CartItem.objects.select_related('product', 'product__category', 'product__primary_image') \
+            .annotate(line_total=F('product__price') * F('quantity'))
         return Cart.objects.filter(user=self.request.user) \
-            .prefetch_related('items', 'items__product', 'items__product__category')
+            .annotate(item_count=Coalesce(Sum('items__quantity'), 0),
+                      subtotal=Coalesce(Sum(F('items__product__price') * F('items__quantity')), Decimal(0))) \
+            .prefetch_related(Prefetch('items', queryset=items))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=["get"])
+    def summary(self, request):
+        cache = shared_cache()
+        key = CART_SUMMARY_KEY.format(request.user.pk)
+        summary = cache.get(key)
+        if summary is None:
+            summary = CartItem.objects.filter(cart__user=request.user).aggregate(
+                count=Coalesce(Sum('quantity'), 0),
+                subtotal=Coalesce(Sum(F('product__price') * F('quantity')), Decimal(0)),
+            )
+            cache.set(key, summary, settings.CART_SUMMARY_TIMEOUT)
+        return Response(summary)
+
     @action(detail=False, methods=["post"], permission_classes=[permissions.IsAuthenticated])
     def clear_cart(self, request):
         cart = Cart.objects.filter(user=request.user).first()
@@ -138,15 +315,46 @@ class CartViewSet(viewsets.ModelViewSet):
         return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
-@method_decorator(cache_page(60), name='list')
-class CartItemViewSet(viewsets.ModelViewSet):
+@method_decorator(metered_cache_page(60), name='list')
+class CartItemViewSet(LikedProductsMixin, viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
+    product_id_field = 'product_id'
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = CustomPagination
 
     def get_queryset(self):
-        return CartItem.objects.select_related('cart', 'product', 'product__category') \
-            .filter(cart__user=self.request.user)
+        return CartItem.objects.select_related('cart', 'product', 'product__category', 'product__primary_image') \
+            .filter(cart__user=self.request.user) \
+            .annotate(line_total=F('product__price') * F('quantity'))
+
+    def perform_create(self, serializer):
+        cart = Cart.objects.filter(user=self.request.user).first()
+        self.save_reserving_stock(serializer, cart=cart)
+
+    def perform_update(self, serializer):
+        self.save_reserving_stock(serializer)
+
+    def save_reserving_stock(self, serializer, **kwargs):
+        try:
+            with transaction.atomic():
+                serializer.save(**kwargs)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'quantity': str(e)})
+        except IntegrityError:
+            # unique_cart_item; the failed save has given the stock back
+            raise serializers.ValidationError(
+                {'product_id': "This product is already in the cart, update that item instead."}
+            )
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = Cart.objects.filter(user=request.user).first()
+        if not cart:
+            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        lines = [(item['product_id'], item['quantity']) for item in serializer.validated_data['items']]
+        return Response({"results": apply_cart_lines(cart, lines)}, status=status.HTTP_200_OK)
 
 
 User = get_user_model()
@@ -183,4 +391,20 @@ class UserUpdateView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # Saved from the current row, request.user may come from the principal cache
+        return CustomUser.objects.get(pk=self.request.user.pk)
+
+
+def metrics_view(request):
+    """
+    Metrics of every worker in the Prometheus text format. Requires
+    `Authorization: Bearer <METRICS_TOKEN>`, or a staff session while
+    METRICS_TOKEN isn't set.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        return HttpResponse(status=403 if request.user.is_authenticated else 401)
+    return HttpResponse(metrics.render(metrics.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
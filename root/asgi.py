@@ -5,6 +5,19 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The async catalog reads under /async/ (app/async_views.py) only free the
+worker while they wait on the database when served from here, e.g.:
+
+    gunicorn root.asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+DRF views keep working under this worker but run in a thread each. Compare
+against the sync deployment with the same data and concurrency:
+
+    python manage.py benchmark http://127.0.0.1:8000/async/product/ --concurrency 64
+    python manage.py benchmark http://127.0.0.1:8000/product/ --concurrency 64
+
+DB_CONN_MODE defaults to `none` here rather than `persistent` (see settings).
 """
 
 import os
@@ -12,5 +25,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "root.settings")
+# Before the settings are loaded, which get_asgi_application() does
+os.environ.setdefault("DB_CONN_MODE", "none")
 
 application = get_asgi_application()
@@ -9,10 +9,14 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import importlib.util
 import os
+import sys
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 from root import settings
@@ -31,6 +35,9 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv('DEBUG')
 
+# `manage.py test`, which gets a mirror replica alias and quieter request logs
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['*']
 
 # Application definition
@@ -45,23 +52,31 @@ INSTALLED_APPS = [
     'app.apps.AppConfig',
     "rest_framework",
     'rest_framework_simplejwt.token_blacklist',
-    'debug_toolbar',
     'drf_spectacular',
+    'django_filters',
 
 ]
 
 MIDDLEWARE = [
+    "app.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "app.middleware.PrimaryStickinessMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 
 ]
 
+# The debug toolbar is for local development only, query counts and timings
+# of every request are in the Server-Timing header (app/middleware.py).
+DEBUG_TOOLBAR = os.getenv('DEBUG_TOOLBAR', '') == 'True'
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = "root.urls"
 
 TEMPLATES = [
@@ -96,6 +111,55 @@ DATABASES = {
     }
 }
 
+# How workers get their database connections:
+# - `persistent`: each worker thread keeps its connection for DB_CONN_MAX_AGE
+#   seconds and checks it is still alive before reusing it after a request;
+# - `pool`: the threads of a worker share a pool of at most DB_POOL_MAX_SIZE
+#   connections, waiting up to DB_POOL_TIMEOUT seconds for a free one. Needs
+#   psycopg 3 with its pool (`pip install "psycopg[binary,pool]"`), which
+#   requirements.txt leaves out because Django then uses it instead of
+#   psycopg2 in every mode;
+# - `none`: a new connection for every request.
+# `manage.py benchmark_connections` compares them on the product list.
+# root/asgi.py defaults to `none`: under ASGI the ORM runs in executor
+# threads that the end-of-request cleanup doesn't reach, so `persistent`
+# connections pile up there (Django advises against them in async mode).
+# Use `pool` to reuse connections under ASGI.
+DB_CONN_MODE = os.getenv('DB_CONN_MODE', 'persistent')
+if DB_CONN_MODE == 'persistent':
+    DATABASES['default'].update(CONN_MAX_AGE=int(os.getenv('DB_CONN_MAX_AGE', 60)), CONN_HEALTH_CHECKS=True)
+elif DB_CONN_MODE == 'pool':
+    if importlib.util.find_spec('psycopg_pool') is None:
+        raise ImproperlyConfigured('DB_CONN_MODE=pool needs `pip install "psycopg[binary,pool]"`.')
+    # With health checks, the pool tests a connection before handing it out
+    DATABASES['default'].update(CONN_HEALTH_CHECKS=True, OPTIONS={'pool': {
+        'min_size': 1,
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 4)),
+        'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+    }})
+elif DB_CONN_MODE != 'none':
+    raise ImproperlyConfigured(f"DB_CONN_MODE must be persistent, pool or none, not {DB_CONN_MODE!r}.")
+
+# Streaming replicas of the primary, as comma separated hosts reached with
+# the primary's credentials. Safe requests to the catalog viewsets read from
+# one of them (app/routers.py), everything else uses `default`.
+REPLICA_DATABASES = []
+for index, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica{index}')
+
+# The replica routing tests (app/tests.py) need a second alias, which reads
+# the primary's test database when there is no replica
+if not REPLICA_DATABASES and TESTING:
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+
+# Seconds reads stay on the primary after a write by the same user or session,
+# and catalog pages read from a replica go uncached after a catalog change;
+# should exceed the worst replication lag.
+REPLICA_STICKY_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -148,7 +212,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly',
@@ -209,7 +273,128 @@ AUTH_USER_MODEL = 'app.CustomUser'
 
 CACHES = {
     'default': {
+        'BACKEND': 'app.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+            'LOCAL_TIMEOUT': 300,
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_MAX_BYTES': 32 * 1024 * 1024,
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': os.path.join(BASE_DIR, 'django_cache'),
+        'OPTIONS': {
+            # Every write lists the whole directory to decide on culling, so
+            # it's kept small, with pages expiring quickly (see
+            # CATALOG_CACHE_TIMEOUT). A culled version key reads as a bump.
+            'MAX_ENTRIES': 2000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+    # Users authenticated by JWT. Another worker's invalidation takes up to
+    # LOCAL_TIMEOUT seconds to reach this one, hence the short memory tier.
+    'principals': {
+        'BACKEND': 'app.cache_backends.TieredCache',
+        'LOCATION': 'principals',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+            'LOCAL_TIMEOUT': 10,
+            'LOCAL_MAX_ENTRIES': 10000,
+            'LOCAL_MAX_BYTES': 8 * 1024 * 1024,
+        },
+    },
+}
+
+# Redis (`pip install redis`) is the shared tier to run in production: its
+# reads and writes don't touch the filesystem and it culls by itself.
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL'),
     }
+
+# Entries every worker must see as soon as they change (namespace version
+# counters, cart summaries) bypass the per-process memory tier.
+SHARED_CACHE_ALIAS = 'shared'
+
+# Where CachedJWTAuthentication keeps users, and for how many seconds
+PRINCIPAL_CACHE_ALIAS = 'principals'
+PRINCIPAL_CACHE_TIMEOUT = 5 * 60
+
+# Catalog pages are invalidated by namespace version bumps in app/signals.py,
+# so with Redis they can stay cached far longer than the data would otherwise
+# allow. Pages of past versions are never read again; the file-based tier
+# only gets rid of them by expiry or culling, so there they live about as
+# long as a version does.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 6 if os.getenv('CACHE_REDIS_URL') else 60 * 10
+
+# Seconds a cart item keeps its stock reserved after its last change. Expired
+# items are released by `manage.py release_expired_reservations`; they stay in
+# the cart with `reserved` false and reserve again when next changed.
+CART_RESERVATION_TTL = 30 * 60
+
+# Cart summaries are dropped on every cart item write, the timeout only
+# bounds how long a product price change can take to show up in them.
+CART_SUMMARY_TIMEOUT = 60
+
+# How often each process compares its category registry (app/registry.py)
+# with the shared `category` cache version, i.e. the longest a category edit
+# made by another worker can take to show up in product payloads.
+CATEGORY_REGISTRY_CHECK_INTERVAL = 5
+
+# Entries kept per process in the category registry; one per category and
+# base URL, and the base URL comes from the Host header.
+CATEGORY_REGISTRY_MAX_ENTRIES = 1000
+
+# Rows fetched from the server-side cursor (and serialized) at a time by the
+# NDJSON export at /product/export/
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+# Build product list pages with FastProductListSerializer (values() rows)
+# instead of ProductSerializer; the JSON is the same.
+FAST_PRODUCT_LIST = os.getenv('FAST_PRODUCT_LIST', '') == 'True'
+
+# Send RequestMetricsMiddleware's timings to clients in a Server-Timing
+# header. They tell how long the database and cache took, so only with DEBUG
+# unless asked for (`manage.py benchmark --server` reads the query counts).
+SERVER_TIMING_HEADER = bool(DEBUG) or os.getenv('SERVER_TIMING_HEADER', '') == 'True'
+
+# Most SQL queries a request to the route (URL name) may run before
+# RequestMetricsMiddleware logs it as a warning, None means no limit.
+DEFAULT_QUERY_BUDGET = 20
+QUERY_BUDGETS = {
+    'product-list': 5,
+    'product-detail': 5,
+    'product-search': 5,
+    'category-list': 3,
+    'category-detail': 3,
+    'cart-list': 5,
+}
+
+# Each worker process writes its metrics (app/metrics.py) to a file in
+# METRICS_DIR every METRICS_FLUSH_INTERVAL seconds, /metrics/ adds them up.
+# All workers of a deployment must share the directory. /metrics/ takes
+# `Authorization: Bearer <METRICS_TOKEN>`, and only staff users without one.
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'texnomart-metrics'))
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # One JSON line per request from RequestMetricsMiddleware: at INFO,
+        # or WARNING when over its query budget
+        'app.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
 }